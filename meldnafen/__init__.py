@@ -1,22 +1,30 @@
 import json
 import logging
 import os
-import sdl2
+import time
 
-from meldnafen.consoles import consoles
-from meldnafen.retroarch import prepare
+from meldnafen.profiler import profiler
+
+# NOTE: the package is imported again after every game, everything else is
+#       imported by the functions that need it
 
 
 DEFAULT_CONFIG = "~/.config/meldnafenrc"
 
+# NOTE: content of the configuration files as they are on disk, used to skip
+#       writing a configuration that did not change
+saved_configs = {}
+
 
 def read_config(config, overrides={}):
+    from meldnafen.consoles import consoles
     settings = {
         'controls': {},
         'border': 10,
         'width': 640,
         'height': 480,
         'fps': 30,
+        'idle_render': False,
         'smooth': False,
         'emulators': [
             {
@@ -26,35 +34,104 @@ def read_config(config, overrides={}):
             for console in consoles.keys()
             if os.path.isdir(os.path.expanduser("~/%s_roms" % console))
         ],
+        'preload_emulators': True,
+        'resident': False,
+        'watch_roms': True,
         'musics': "~/bgm",
+        'bgm_cache_size': 0,
+        'bgm_cache_seconds': 180,
+        'cache': "~/.cache/meldnafen",
+        'database': "~/.local/share/meldnafen/roms.sqlite",
+        'checksum_roms': True,
         'startup': [
             "amixer sset PCM 0dB",
         ]
     }
+    path = os.path.expanduser(config)
     try:
-        with open(os.path.expanduser(config)) as rc:
-            settings.update(json.load(rc))
+        with open(path) as rc:
+            content = rc.read()
+        settings.update(json.loads(content))
     except Exception:
         # NOTE: the configuration is broken or not accessible, just ignore it
         pass
+    else:
+        saved_configs[path] = content
     settings.update(overrides)
     return settings
 
 
 def write_config(settings):
+    from meldnafen.storage import atomic_write
     # NOTE: serialize first in case an error occur
     serialized = json.dumps(settings, sort_keys=True, indent=2)
-    with open(os.path.expanduser(DEFAULT_CONFIG), 'wt') as rc:
-        rc.write(serialized)
+    path = os.path.expanduser(DEFAULT_CONFIG)
+    if saved_configs.get(path) == serialized:
+        return False
+    atomic_write(path, serialized, fsync=True)
+    saved_configs[path] = serialized
+    return True
 
 
-def start_meldnafen(**kwargs):
-    from meldnafen.app import Meldnafen
+def rebuild_rom_index(**kwargs):
+    from meldnafen.consoles import consoles
+    from meldnafen.roms.index import RomIndex, rom_paths
+    from meldnafen.storage import cache_dir
     logging.basicConfig(
         level=(logging.DEBUG if kwargs['debug'] else logging.INFO))
-    settings = read_config(kwargs.get('config', DEFAULT_CONFIG), kwargs)
+    settings = read_config(kwargs.get('config', DEFAULT_CONFIG))
+    for emulator in settings['emulators']:
+        options = dict(consoles[emulator['console']], **emulator)
+        for path in rom_paths(options['path']):
+            roms = RomIndex(
+                path,
+                include=options.get('include'),
+                exclude=options.get('exclude'),
+                cache=cache_dir(settings, 'roms'),
+                archives=options.get('archives', False)).scan(rebuild=True)
+            logging.info("%s: %d roms indexed in %s",
+                options['console'], len(roms), path)
+
+
+def checksum_roms(**kwargs):
+    from meldnafen.consoles import consoles
+    from meldnafen.roms.checksum import ChecksumWorker
+    from meldnafen.roms.database import RomDatabase, sync_database
+    from meldnafen.roms.index import RomIndex, rom_paths
+    from meldnafen.storage import cache_dir
+    logging.basicConfig(
+        level=(logging.DEBUG if kwargs['debug'] else logging.INFO))
+    settings = read_config(kwargs.get('config', DEFAULT_CONFIG))
+    if not settings.get('database'):
+        logging.error("The rom database is disabled")
+        return
+    dats = {}
+    for emulator in settings['emulators']:
+        options = dict(consoles[emulator['console']], **emulator)
+        for path in rom_paths(options['path']):
+            index = RomIndex(
+                path,
+                include=options.get('include'),
+                exclude=options.get('exclude'),
+                cache=cache_dir(settings, 'roms'),
+                archives=options.get('archives', False))
+            sync_database(settings['database'], options['console'],
+                index.path, index.scan())
+        if options.get('dat'):
+            dats[options['console']] = options['dat']
+    worker = ChecksumWorker(settings['database'], dats)
+    worker.run()
+    logging.info("%d checksums computed", worker.count)
+    with RomDatabase(settings['database']) as database:
+        duplicates = database.duplicates()
+    for sha1, console, root, path in duplicates:
+        logging.info("Duplicate %s: %s", sha1, os.path.join(root, path))
+
+
+def app_props(settings):
+    import sdl2
     zoom = min(int(settings['width'] / 256), int(settings['height'] / 224))
-    props = {
+    return {
         'zoom': (zoom if zoom > 0 else 1),
         'renderer_flags': 0,
         'init_flags': sdl2.SDL_INIT_VIDEO | sdl2.SDL_INIT_AUDIO,
@@ -62,9 +139,35 @@ def start_meldnafen(**kwargs):
         'height': settings['height'],
         'fps': settings['fps'],
     }
-    app = Meldnafen.run(settings=settings, **props)
+
+
+def start_meldnafen(**kwargs):
+    profiler.output = kwargs.pop('profile_startup', None)
+    with profiler.phase("import app"):
+        from meldnafen.app import Meldnafen
+        from meldnafen.retroarch import prepare
+    logging.basicConfig(
+        level=(logging.DEBUG if kwargs['debug'] else logging.INFO))
+    with profiler.phase("read_config"):
+        settings = read_config(kwargs.get('config', DEFAULT_CONFIG), kwargs)
+    profiler.begin("SDL init")
+    # NOTE: in resident mode the games are run by the app itself
+    app = Meldnafen.run(settings=settings, **app_props(settings))
     if app.state['command']:
         command = prepare(
             app.state['command'], app.state['controls'], app.settings)
         os.execvp(command[0], command)
     exit(2)
+
+
+def run_child(command):
+    import subprocess
+    logging.info("Running %s", " ".join(command))
+    start = time.monotonic()
+    try:
+        status = subprocess.call(command)
+    except OSError as exc:
+        logging.error("Could not run %s: %s", command[0], exc)
+        return
+    logging.info("%s exited with status %d after %.1fs",
+        command[0], status, time.monotonic() - start)
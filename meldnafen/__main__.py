@@ -1,10 +1,31 @@
 import argparse
+import time
 
-from meldnafen import start_meldnafen
+START = time.perf_counter(), time.process_time()
 
+from meldnafen import checksum_roms, rebuild_rom_index, start_meldnafen
+from meldnafen.profiler import profiler
 
-parser = argparse.ArgumentParser()
-parser.add_argument('--debug', '-d', action='store_true', default=False)
-opts = parser.parse_args()
 
-start_meldnafen(**vars(opts))
+# NOTE: the checksum processes import this module again
+if __name__ == '__main__':
+    profiler.record("imports", START)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--debug', '-d', action='store_true', default=False)
+    parser.add_argument('--rebuild-index', action='store_true', default=False,
+        help="rebuild the rom index of every emulator and exit")
+    parser.add_argument('--checksums', action='store_true', default=False,
+        help="compute the checksum of every rom, list the duplicates and "
+            "exit")
+    parser.add_argument('--profile-startup', metavar='PATH',
+        help="write the duration of each startup phase to PATH as JSON")
+    opts = vars(parser.parse_args())
+
+    if opts.pop('rebuild_index'):
+        opts.pop('checksums')
+        rebuild_rom_index(**opts)
+    elif opts.pop('checksums'):
+        checksum_roms(**opts)
+    else:
+        start_meldnafen(**opts)
@@ -1,20 +1,21 @@
-import os
+import ctypes
 import sdl2
 import sdl2ui
-from sdl2ui.mixer import Mixer
 import sdl2ui.mixins
-from sdl2ui.debugger import Debugger
 from sdl2ui.joystick import JoystickManager
 
 import meldnafen
+from meldnafen.idle import IdleRenderer, InvalidateMixin
 from meldnafen.joystick import MenuJoystick
 from meldnafen.mixins.bgm import BgmMixin
 from meldnafen.mixins.controls import ControlsMixin
 from meldnafen.mixins.emulator import EmulatorMixin
+from meldnafen.profiler import profiler
+from meldnafen.startup import run_startup_commands
 
 
 class Meldnafen(
-        sdl2ui.App, sdl2ui.mixins.ImmutableMixin,
+        InvalidateMixin, sdl2ui.App, sdl2ui.mixins.ImmutableMixin,
         BgmMixin, EmulatorMixin, ControlsMixin):
 
     name = "Meldnafen"
@@ -31,29 +32,34 @@ class Meldnafen(
     def settings(self):
         return self.state['settings']
 
+    @property
+    def debug_mode(self):
+        return self.debugger is not None and self.debugger.active
+
     def startup(self):
         if self.settings.get('startup'):
-            for command in self.settings['startup']:
-                os.system(command)
+            self.startup_commands = run_startup_commands(
+                self.settings['startup'])
 
     def init(self):
+        profiler.end("SDL init")
         self.set_state({
             'settings': self.props['settings'].copy(),
         })
+        self.idle_renderer = (
+            IdleRenderer(self) if self.settings.get('idle_render') else None)
         self.keyboard_mapping = {
             sdl2.SDL_SCANCODE_Q: self.app.quit,
             sdl2.SDL_SCANCODE_D: self.toggle_debug_mode,
         }
-        self.startup()
+        with profiler.phase("startup commands"):
+            self.startup()
         sdl2.SDL_ShowCursor(sdl2.SDL_FALSE)
         sdl2.SDL_SetHint(sdl2.SDL_HINT_JOYSTICK_ALLOW_BACKGROUND_EVENTS, b"1")
-        self.load_resource('font-12', 'font-12.png')
-        self.resources['font-12'].make_font(
-            "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789!?("
-            ")[]<>~-_+@:/'., ")
-        self.debugger = self.add_component(Debugger,
-            x=self.x - 8,
-            y=self.y - 8)
+        with profiler.phase("font"):
+            self.load_resource('font-12', 'font-12.png')
+            self.make_fonts()
+        self.debugger = None
         self.joystick_manager = self.add_component(JoystickManager)
         self.joystick = self.add_component(MenuJoystick,
             manager=self.joystick_manager,
@@ -62,31 +68,161 @@ class Meldnafen(
             on_joystick_removed=self.menu_joystick_removed)
         self.register_event_handler(sdl2.SDL_KEYDOWN, self.keypress)
 
+    def make_fonts(self):
+        self.resources['font-12'].make_font(
+            "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+            "!?()[]<>~-_+@:/'., ")
+
     def activate(self):
         if self.settings['debug']:
-            self.debugger.enable()
+            self.set_debug_mode(True)
+        if self.idle_renderer:
+            self.idle_renderer.start()
+        profiler.begin("first frame")
+        # NOTE: timers are processed by the main loop, this one is called
+        #       once the first frame has been presented
+        self.add_timer(0, self.first_frame)
+
+    def first_frame(self):
+        profiler.end("first frame")
+        profiler.write()
 
     def quit(self, exception=None):
+        self.release_emulators()
         if not isinstance(exception, Exception):
-            try:
-                meldnafen.write_config(self.settings)
-            except Exception:
-                self.logger.error("Could not save configuration")
-            else:
-                self.logger.debug("Configuration saved")
+            self.save_config()
         sdl2ui.App.quit(self)
 
+    def save_config(self):
+        try:
+            saved = meldnafen.write_config(self.settings)
+        except Exception:
+            self.logger.error("Could not save configuration")
+        else:
+            self.logger.debug(
+                "Configuration saved" if saved else "Configuration unchanged")
+
+    def run_resident(self, command):
+        # NOTE: the emulator gets the display, the audio device and the CPU
+        #       while the components keep their state
+        self.save_config()
+        self.stop_checksums()
+        self.stop_bgm()
+        video = self.release_video()
+        try:
+            meldnafen.run_child(command)
+        finally:
+            self.restore_video(video)
+            # NOTE: the inputs were meant for the emulator, the joystick
+            #       devices added or removed in the meantime are kept
+            sdl2.SDL_FlushEvents(sdl2.SDL_KEYDOWN, sdl2.SDL_MOUSEWHEEL)
+            sdl2.SDL_FlushEvents(
+                sdl2.SDL_JOYAXISMOTION, sdl2.SDL_JOYBUTTONUP)
+            self.restart_bgm()
+            self.schedule_checksums()
+            self.invalidate_frame()
+
+    def release_video(self):
+        # NOTE: the display is only given to the emulator once the window
+        #       and the renderer are destroyed, the textures are destroyed
+        #       with the renderer
+        renderer = self.renderer
+        window = sdl2.SDL_RenderGetWindow(renderer)
+        w, h = ctypes.c_int(), ctypes.c_int()
+        sdl2.SDL_GetWindowSize(window, ctypes.byref(w), ctypes.byref(h))
+        lw, lh = ctypes.c_int(), ctypes.c_int()
+        sdl2.SDL_RenderGetLogicalSize(renderer, ctypes.byref(lw),
+            ctypes.byref(lh))
+        sx, sy = ctypes.c_float(), ctypes.c_float()
+        sdl2.SDL_RenderGetScale(renderer, ctypes.byref(sx), ctypes.byref(sy))
+        viewport = sdl2.SDL_Rect()
+        sdl2.SDL_RenderGetViewport(renderer, ctypes.byref(viewport))
+        video = {
+            'title': sdl2.SDL_GetWindowTitle(window),
+            'flags': sdl2.SDL_GetWindowFlags(window),
+            'size': (w.value, h.value),
+            'logical_size': (lw.value, lh.value),
+            'scale': (sx.value, sy.value),
+            'viewport': viewport,
+        }
+        sdl2.SDL_DestroyRenderer(renderer)
+        sdl2.SDL_DestroyWindow(window)
+        sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_VIDEO)
+        return video
+
+    def restore_video(self, video):
+        sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_VIDEO)
+        flags = video['flags'] & (
+            sdl2.SDL_WINDOW_FULLSCREEN_DESKTOP | sdl2.SDL_WINDOW_BORDERLESS |
+            sdl2.SDL_WINDOW_RESIZABLE | sdl2.SDL_WINDOW_OPENGL)
+        window = sdl2.SDL_CreateWindow(video['title'],
+            sdl2.SDL_WINDOWPOS_UNDEFINED, sdl2.SDL_WINDOWPOS_UNDEFINED,
+            *video['size'], flags | sdl2.SDL_WINDOW_SHOWN)
+        if not window:
+            raise RuntimeError(
+                "Could not create the window: %s" % sdl2.SDL_GetError())
+        renderer = sdl2.SDL_CreateRenderer(window, -1,
+            self.props['renderer_flags'])
+        if not renderer:
+            raise RuntimeError(
+                "Could not create the renderer: %s" % sdl2.SDL_GetError())
+        if any(video['logical_size']):
+            sdl2.SDL_RenderSetLogicalSize(renderer, *video['logical_size'])
+        else:
+            sdl2.SDL_RenderSetScale(renderer, *video['scale'])
+            sdl2.SDL_RenderSetViewport(renderer,
+                ctypes.byref(video['viewport']))
+        if hasattr(self, 'window'):
+            self.window = window
+        self.renderer = renderer
+        sdl2.SDL_ShowCursor(sdl2.SDL_FALSE)
+        sdl2.SDL_RaiseWindow(window)
+        # NOTE: the textures of the resources belonged to the old renderer,
+        #       the render caches notice the new one by themselves
+        for resource in self.resources.values():
+            resource.load()
+        self.make_fonts()
+
+    def add_timer(self, delay, *args, **kwargs):
+        # NOTE: timers may be added before init
+        idle_renderer = getattr(self, 'idle_renderer', None)
+        if kwargs.pop('track', True) and idle_renderer:
+            return idle_renderer.add_timer(delay, *args, **kwargs)
+        return sdl2ui.App.add_timer(self, delay, *args, **kwargs)
+
     def keypress(self, event):
         if event.key.keysym.scancode in self.keyboard_mapping:
             self.keyboard_mapping[event.key.keysym.scancode]()
 
+    def get_debugger(self):
+        # NOTE: the debugger is only loaded when it is used
+        if self.debugger is None:
+            from sdl2ui.debugger import Debugger
+            from meldnafen.memory import MemoryStats
+            self.debugger = self.add_component(Debugger,
+                x=self.x - 8,
+                y=self.y - 8)
+            self.memory_stats = self.add_component(MemoryStats,
+                line_space=10,
+                x=self.x,
+                y=self.y + 200)
+        return self.debugger
+
+    def set_debug_mode(self, enabled):
+        debugger = self.get_debugger()
+        for component in (debugger, self.memory_stats):
+            if enabled:
+                component.enable()
+            else:
+                component.disable()
+
     def toggle_debug_mode(self):
-        self.debugger.toggle()
+        self.set_debug_mode(not self.debug_mode)
 
     def lock(self):
-        self.emulators[self.state['emulator']].disable()
+        self.emulator.disable()
         self.joystick.disable()
 
     def unlock(self):
-        self.emulators[self.state['emulator']].enable()
+        self.emulator.enable()
         self.joystick.enable()
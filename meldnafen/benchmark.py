@@ -0,0 +1,287 @@
+import argparse
+import glob
+import os
+import random
+import shutil
+import sys
+import time
+
+import meldnafen
+from meldnafen.storage import load_json, save_json
+
+
+SIZES = [1000, 10000, 100000]
+
+# NOTE: a rom set as it is dumped, the good dumps are listed with the
+#       prototypes released in the USA, the rest is hidden
+INCLUDE = "*(USA)*(Proto)*"
+EXCLUDE = "*.txt;*.nfo;*.png;*(Beta*)*;*(Proto*)*"
+
+WORDS = [
+    "adventure", "battle", "blaster", "castle", "dragon", "fighter",
+    "galaxy", "hero", "island", "jungle", "knight", "legend", "mega",
+    "ninja", "quest", "racer", "soccer", "super", "tennis", "turbo",
+    "warrior", "world", "zone", "étoile", "pinball", "golf",
+]
+REGIONS = ["(USA)", "(Europe)", "(Japan)", "(World)", "(USA, Europe)"]
+FLAGS = ["", "", "", " (Rev 1)", " (Beta)", " (Proto)", " [!]", " [b1]",
+    " [h1]"]
+JUNK = [".txt", ".nfo", ".png"]
+# NOTE: bumped when the trees change so the old ones are generated again
+TREE_VERSION = 1
+
+# NOTE: differences below this are noise, whatever the tolerance
+MIN_DELTA = 0.05
+
+
+def make_tree(path, size, seed=0):
+    """
+    Create a tree of empty roms sorted in a directory per initial letter,
+    with a few nested directories and files that are not roms.
+    """
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < size:
+        title = " ".join(rng.choice(WORDS).title()
+            for _ in range(rng.randint(1, 4)))
+        name = "%s %s%s" % (title, rng.choice(REGIONS), rng.choice(FLAGS))
+        ext = rng.choice(JUNK) if rng.random() < 0.1 else ".nes"
+        subdir = title[0].upper()
+        if rng.random() < 0.05:
+            subdir = os.path.join(subdir, "Hacks")
+        names.add(os.path.join(subdir, name + ext))
+    for name in sorted(names):
+        filepath = os.path.join(path, name)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        open(filepath, 'w').close()
+
+
+def prepare_tree(workdir, size):
+    path = os.path.join(workdir, "roms-%d" % size)
+    # NOTE: the marker is outside of the tree so it is not scanned
+    marker = path + ".json"
+    if load_json(marker) != {'version': TREE_VERSION, 'size': size}:
+        print("Generating %d roms in %s..." % (size, path))
+        shutil.rmtree(path, ignore_errors=True)
+        make_tree(path, size)
+        save_json(marker, {'version': TREE_VERSION, 'size': size})
+    return path
+
+
+def timeit(func, runs, number=1, setup=None):
+    """
+    Return the fastest of the runs in milliseconds per call.
+    """
+    best = None
+    for _ in range(runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best * 1000
+
+
+def large_controls(games):
+    guid = "030000005e0400008e02000014010000"
+    mapping = {
+        "%s_btn" % x: str(i)
+        for i, x in enumerate(["up", "down", "left", "right", "a", "b", "x",
+            "y", "l", "r", "select", "start"])
+    }
+    players = {str(x): {guid: dict(mapping)} for x in range(1, 5)}
+    return {
+        'console': {'nes': players},
+        'game': {
+            'nes': {
+                "Game %05d (USA).nes" % i: players for i in range(games)
+            },
+        },
+    }
+
+
+def bench_config(results, opts):
+    settings = meldnafen.read_config(meldnafen.DEFAULT_CONFIG)
+    settings['controls'] = large_controls(opts.games)
+
+    def write():
+        # NOTE: an unchanged configuration is not written
+        settings['smooth'] = not settings['smooth']
+        meldnafen.write_config(settings)
+
+    results['write_config'] = timeit(write, opts.runs)
+    results['write_config (unchanged)'] = timeit(
+        lambda: meldnafen.write_config(settings), opts.runs)
+    results['read_config'] = timeit(
+        lambda: meldnafen.read_config(meldnafen.DEFAULT_CONFIG), opts.runs)
+
+
+def bench_retroarch(results, opts):
+    from meldnafen.retroarch import prepare
+    settings = meldnafen.read_config(meldnafen.DEFAULT_CONFIG)
+    controls = large_controls(0)['console']['nes']
+    controls = {
+        player: next(iter(x.values())) for player, x in controls.items()
+    }
+    results['retroarch.prepare'] = timeit(
+        lambda: prepare(['retroarch'], controls, settings), opts.runs, 10)
+
+
+def wait_scan(view):
+    for job in view.jobs:
+        while not job.done:
+            time.sleep(0.001)
+    view.poll_scan()
+
+
+def bench_list(results, opts, app, index, size):
+    from meldnafen.roms.index import loaded_indexes
+    emulator = app.get_emulator(index)
+    view = emulator.list
+    label = "%dk" % (size // 1000)
+    wait_scan(view)
+
+    def clear_index():
+        for filename in glob.glob(os.path.join(
+                os.path.expanduser(app.settings['cache']), 'roms', '*')):
+            os.unlink(filename)
+        loaded_indexes.clear()
+
+    def update_list():
+        view.update_list()
+        wait_scan(view)
+
+    results['ListRoms.update_list %s (cold)' % label] = timeit(
+        update_list, opts.runs, setup=clear_index)
+    results['ListRoms.update_list %s' % label] = timeit(update_list, opts.runs)
+    view.select_index(0)
+    view.render()
+    results['ListRoms.render %s' % label] = timeit(view.render, opts.runs, 100)
+
+    def next_page():
+        if view.state['page'] == view.state['last_page']:
+            view.select_index(0)
+        else:
+            view.next_page()
+        view.render()
+
+    results['ListRoms.next_page %s' % label] = timeit(
+        next_page, opts.runs, 20)
+
+    def next_letter():
+        if view.state['page'] == view.state['last_page']:
+            view.select_index(0)
+        else:
+            view.next_letter()
+        view.render()
+
+    results['ListRoms.next_letter %s' % label] = timeit(
+        next_letter, opts.runs, 20)
+    emulator.show_menu({
+        'game': view.game,
+        'app': app,
+    })
+    emulator.menu.render()
+    results['Menu.render %s' % label] = timeit(
+        emulator.menu.render, opts.runs, 100)
+    emulator.hide_menu()
+
+
+def bench_app(results, opts, trees):
+    from meldnafen.app import Meldnafen
+
+    settings = meldnafen.read_config(meldnafen.DEFAULT_CONFIG, {
+        'debug': False,
+        'emulators': [
+            {
+                'console': 'nes',
+                'path': path,
+                'include': INCLUDE,
+                'exclude': EXCLUDE,
+            }
+            for path in trees
+        ],
+        'preload_emulators': False,
+        'watch_roms': False,
+        'musics': None,
+        'database': None,
+        'checksum_roms': False,
+        'startup': [],
+    })
+    errors = []
+
+    class BenchmarkApp(Meldnafen):
+        def first_frame(self):
+            Meldnafen.first_frame(self)
+            try:
+                for index, size in enumerate(opts.sizes):
+                    bench_list(results, opts, self, index, size)
+            except BaseException as exc:
+                errors.append(exc)
+            self.quit()
+
+    BenchmarkApp.run(settings=settings, **meldnafen.app_props(settings))
+    if errors:
+        raise errors[0]
+
+
+def compare(results, baseline, tolerance):
+    ok = True
+    for name, elapsed in results.items():
+        line = "%-40s %10.3f ms" % (name, elapsed)
+        if name in baseline:
+            delta = elapsed - baseline[name]
+            line += "  %+6.1f%%" % (100 * delta / baseline[name])
+            if delta > MIN_DELTA and delta > baseline[name] * tolerance:
+                line += "  REGRESSION"
+                ok = False
+        print(line)
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m meldnafen.benchmark",
+        description="measure meldnafen on synthetic rom trees and compare "
+            "the results with a baseline")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+        help="number of files of the rom trees (default: %(default)s)")
+    parser.add_argument('--runs', type=int, default=5,
+        help="the fastest of RUNS is kept (default: %(default)s)")
+    parser.add_argument('--games', type=int, default=2000,
+        help="number of games with their own controls in the configuration "
+            "(default: %(default)s)")
+    parser.add_argument('--workdir', default="~/.cache/meldnafen-benchmark",
+        help="where the rom trees are generated (default: %(default)s)")
+    parser.add_argument('--baseline', metavar='PATH',
+        help="baseline to compare with (default: baseline.json in WORKDIR)")
+    parser.add_argument('--save', action='store_true', default=False,
+        help="save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help="slowdown reported as a regression (default: %(default)s)")
+    opts = parser.parse_args()
+    workdir = os.path.expanduser(opts.workdir)
+    baseline = opts.baseline or os.path.join(workdir, "baseline.json")
+    # NOTE: the configuration and the caches are written in a home of
+    #       their own, nothing needs a display, a sound card or a network
+    os.makedirs(os.path.join(workdir, "home", ".config"), exist_ok=True)
+    os.environ['HOME'] = os.path.join(workdir, "home")
+    os.environ['SDL_VIDEODRIVER'] = "dummy"
+    os.environ['SDL_AUDIODRIVER'] = "dummy"
+    trees = [prepare_tree(workdir, x) for x in opts.sizes]
+    results = {}
+    bench_config(results, opts)
+    bench_retroarch(results, opts)
+    bench_app(results, opts, trees)
+    ok = compare(results, load_json(baseline, {}), opts.tolerance)
+    if opts.save:
+        save_json(baseline, results)
+        print("Baseline saved to %s" % baseline)
+        return 0
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
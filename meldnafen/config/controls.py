@@ -4,11 +4,14 @@ import sdl2ui
 import sdl2ui.joystick
 import sdl2ui.mixins
 
+from meldnafen.idle import InvalidateMixin
+
 
 DEFAULT_COUNTDOWN = 8
 
 
-class JoystickCapture(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+class JoystickCapture(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def init(self):
         self.register_event_handler(
             sdl2.SDL_JOYBUTTONDOWN, self.capture_button)
@@ -58,17 +61,31 @@ class JoystickCapture(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
             self.register_control("{}_btn", self.hat_change)
             self.hat_change = None
 
+    def is_used(self, mapping, input):
+        suffix = mapping.format("")
+        return any(
+            k.endswith(suffix) and v == input
+            for k, v in self.state['config'].items())
+
     def register_control(self, mapping, input):
         if not self.capture:
             return
+        control = self.state['controls'][0]
+        optional = len(control) > 2 and control[2]
+        used = self.props.get('unique') and self.is_used(mapping, input)
+        # NOTE: an input already bound is refused, it skips an optional
+        #       control
+        if used and not optional:
+            return
         self.capture = False
         self.app.add_timer(100, self.reset_capture)
         new_controls = self.state['controls'].copy()
         control = new_controls.pop(0)
         new_config = self.state['config'].copy()
-        new_config.update({
-            mapping.format(control[0]): input,
-        })
+        if not used:
+            new_config.update({
+                mapping.format(control[0]): input,
+            })
         self.set_state({
             'config': new_config,
             'x': control,
@@ -83,13 +100,20 @@ class JoystickCapture(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
 
     def render(self):
         x, y = self.props['x'], self.props['y']
-        self.app.write('font-12', x, y, self.state['controls'][0][1])
+        control = self.state['controls'][0]
+        self.app.write('font-12', x, y, control[1])
+        if len(control) > 2 and control[2]:
+            self.app.write('font-12', x, y + self.props['line_space'],
+                "Optional: press a used button to skip")
 
 
-class Controls(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+class Controls(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def init(self):
         self.capture = self.add_component(JoystickCapture,
             on_finish=self.finish,
+            unique=self.props.get('unique', False),
+            line_space=self.props['line_space'],
             x=self.props['x'],
             y=self.props['y'] + self.props['line_space'] * 4)
         self.register_event_handler(sdl2.SDL_JOYDEVICEADDED, self.detect)
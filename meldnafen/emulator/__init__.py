@@ -1,30 +1,41 @@
 from functools import partial
+import os
 import sdl2ui
 import sdl2ui.mixins
 
 from meldnafen.config.controls import Controls
+from meldnafen.idle import InvalidateMixin
+from meldnafen.profiler import profiler
+from meldnafen.roms.index import rom_paths
 from .list_roms import ListRoms
 from .menu import Menu
 
 
-class Emulator(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+# NOTE: games listed in the played menus
+PLAYED_GAMES = 5
+
+
+class Emulator(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def init(self):
         self.logger.debug(
             "Loading emulator %s: %d players",
             self.props['console'],
             self.props['players_number'])
-        self.list = self.add_component(ListRoms,
-            show_menu=self.show_menu,
-            hide_menu=self.hide_menu,
-            **self.props)
-        self.menu = self.add_component(Menu,
-            menu=self.generate_menu(),
-            highlight=self.props['highlight'],
-            line_space=10,
-            x=self.props['x'],
-            y=self.props['y'],
-            on_quit=self.hide_menu)
-        self.load_joystick_components()
+        with profiler.phase("emulator %s" % self.props['console']):
+            self.list = self.add_component(ListRoms,
+                show_menu=self.show_menu,
+                hide_menu=self.hide_menu,
+                **self.props)
+            self.static_menu = self.generate_menu()
+            self.menu = self.add_component(Menu,
+                menu=self.static_menu,
+                highlight=self.props['highlight'],
+                line_space=10,
+                x=self.props['x'],
+                y=self.props['y'],
+                on_quit=self.hide_menu)
+            self.load_joystick_components()
         self.list.enable()
 
     def load_joystick_components(self):
@@ -48,7 +59,8 @@ class Emulator(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
                 y=self.props['y'])
 
     def show_menu(self, vars):
-        self.menu.start(vars)
+        # NOTE: the games played change after every game
+        self.menu.start(vars, self.generate_played_menu() + self.static_menu)
         self.list.disable()
         self.props['on_menu_activated']()
 
@@ -80,9 +92,35 @@ class Emulator(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
                     self.app.activate_joystick_configuration)
             ]),
             ("Smooth: {app.settings[smooth]}", "call", self.app.toggle_smooth),
-            ("FPS: {app.debugger.active}", "call", self.app.debugger.toggle),
+            ("FPS: {app.debug_mode}", "call", self.app.toggle_debug_mode),
         ]
 
+    def generate_played_menu(self):
+        roots = set(
+            os.path.expanduser(x) for x in rom_paths(self.props['path']))
+        menu = []
+        for label, method in [
+                ("Recently played", 'recently_played'),
+                ("Most played", 'most_played')]:
+            games = [
+                path for root, path in self.app.query_database(
+                    method, self.props['console'], PLAYED_GAMES) or []
+                if root in roots
+            ]
+            if not games:
+                continue
+            menu.append((label, "submenu", [
+                # NOTE: the labels are format strings
+                (game.replace("{", "{{").replace("}", "}}"), "call",
+                    partial(self.jump_to_game, game))
+                for game in games
+            ]))
+        return menu
+
+    def jump_to_game(self, game):
+        self.hide_menu()
+        self.list.jump_to_game(game)
+
     def confgure_controls(self, **kwargs):
         self.app.lock()
         self.joystick_configure[kwargs['player']].start(**kwargs)
@@ -1,28 +1,91 @@
 from __future__ import division
 
-import fnmatch
-from itertools import islice
+from bisect import bisect_left, bisect_right
+from functools import partial
+from heapq import merge
 from math import ceil
 import os
-import re
 import sdl2
 import sdl2ui
 import sdl2ui.mixins
 
 from meldnafen.exceptions import MissingControls
+from meldnafen.idle import InvalidateMixin
+from meldnafen.render_cache import RenderCache
+from meldnafen.roms.compact import CompactList, MergedList
+from meldnafen.roms.index import merge_roms
+from meldnafen.roms.search import SearchIndexBuilder
+from meldnafen.roms.watcher import DirectoryWatcher
 
 
-class ListRoms(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+SCAN_POLL_DELAY = 200
+SEARCH_POLL_DELAY = 50
+WATCH_POLL_DELAY = 500
+
+PICKER_CHARS = "abcdefghijklmnopqrstuvwxyz0123456789 "
+# NOTE: number of characters displayed on each side of the picked one
+PICKER_WINDOW = 4
+
+
+def initial(rom):
+    # NOTE: the scans are recursive, the letter is the one of the file name
+    #       and not the one of its directory
+    return rom[rom.rfind("/") + 1:][:1].casefold()
+
+
+def find_initials(roms):
+    """
+    Return the index of the first rom of every run of roms whose file names
+    start with the same letter, case insensitively. The list is sorted by
+    path, a letter starts a run in every directory.
+    """
+    initials = []
+    last = None
+    for index, rom in enumerate(roms):
+        letter = initial(rom)
+        if letter != last:
+            initials.append(index)
+            last = letter
+    return initials
+
+
+class ListRoms(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def init(self):
         self.keyboard_mapping = {
             sdl2.SDL_SCANCODE_DOWN: self.next_option,
             sdl2.SDL_SCANCODE_UP: self.prev_option,
             sdl2.SDL_SCANCODE_RIGHT: self.switch_right,
             sdl2.SDL_SCANCODE_LEFT: self.switch_left,
+            sdl2.SDL_SCANCODE_PAGEDOWN: self.next_letter,
+            sdl2.SDL_SCANCODE_PAGEUP: self.prev_letter,
             sdl2.SDL_SCANCODE_RETURN: self.run_emulator,
             sdl2.SDL_SCANCODE_ESCAPE: self.show_menu,
+            sdl2.SDL_SCANCODE_BACKSPACE: self.focus_picker,
+            sdl2.SDL_SCANCODE_SLASH: self.start_search,
+        }
+        # NOTE: used in search mode while the cursor is on the picker
+        self.picker_mapping = {
+            sdl2.SDL_SCANCODE_DOWN: self.next_option,
+            sdl2.SDL_SCANCODE_RIGHT: self.next_char,
+            sdl2.SDL_SCANCODE_LEFT: self.prev_char,
+            sdl2.SDL_SCANCODE_RETURN: self.type_char,
+            sdl2.SDL_SCANCODE_BACKSPACE: self.delete_char,
+            sdl2.SDL_SCANCODE_ESCAPE: self.stop_search,
+            sdl2.SDL_SCANCODE_SLASH: self.stop_search,
         }
         self.register_event_handler(sdl2.SDL_KEYDOWN, self.keypress)
+        self.title = "< %s >" % self.props['name']
+        self.search_builder = None
+        self.set_state({
+            'query': None,
+            'picker': 0,
+        })
+        self.render_cache = RenderCache(self.app)
+        self.register_event_handler(
+            sdl2.SDL_RENDER_TARGETS_RESET, self.render_cache.invalidate)
+        self.watchers = []
+        self.initials = (None, [])
         self.update_list()
 
     @property
@@ -31,9 +94,28 @@ class ListRoms(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
             self.state['select']
         return self.state['roms'][index]
 
+    @property
+    def heading(self):
+        if self.state['query'] is None:
+            return self.title
+        return "Search: %s" % self.state['query']
+
+    @property
+    def picker(self):
+        chars = [
+            PICKER_CHARS[(self.state['picker'] + i) % len(PICKER_CHARS)]
+            for i in range(-PICKER_WINDOW, PICKER_WINDOW + 1)
+        ]
+        chars = [x.replace(" ", "_") for x in chars]
+        chars[PICKER_WINDOW] = "[%s]" % chars[PICKER_WINDOW]
+        return " ".join(chars)
+
     def keypress(self, event):
-        if event.key.keysym.scancode in self.keyboard_mapping:
-            self.keyboard_mapping[event.key.keysym.scancode]()
+        mapping = self.keyboard_mapping
+        if self.state['query'] is not None and self.state['select'] == -1:
+            mapping = self.picker_mapping
+        if event.key.keysym.scancode in mapping:
+            mapping[event.key.keysym.scancode]()
 
     def next_option(self):
         if not self.state['roms']:
@@ -93,20 +175,153 @@ class ListRoms(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
             'page': self.state['page'] - 1,
         })
 
+    def get_initials(self):
+        # NOTE: computed the first time a letter jump is used on a list, it
+        #       is a linear pass
+        roms = self.state['roms']
+        if self.initials[0] is not roms:
+            self.initials = (roms, find_initials(roms))
+        return self.initials[1]
+
+    def next_letter(self):
+        initials = self.get_initials()
+        if not initials:
+            return
+        index = self.state['page'] * self.props['page_size'] + \
+            self.state['select']
+        position = bisect_right(initials, index)
+        if position < len(initials):
+            self.select_index(initials[position])
+
+    def prev_letter(self):
+        initials = self.get_initials()
+        if not initials or self.state['select'] == -1:
+            return
+        index = self.state['page'] * self.props['page_size'] + \
+            self.state['select']
+        position = bisect_left(initials, index)
+        self.select_index(initials[max(position - 1, 0)])
+
+    def select_index(self, index):
+        page, select = divmod(index, self.props['page_size'])
+        self.set_state({
+            'page': page,
+            'select': select,
+        })
+
+    def start_search(self):
+        if self.state['query'] is not None:
+            return
+        self.set_state({
+            'select': -1,
+            'page': 0,
+        })
+        self.set_query("")
+
+    def stop_search(self):
+        matches = self.state['roms'] if self.state['query'] else []
+        self.set_state({
+            'query': None,
+            'select': -1,
+            'page': 0,
+        })
+        self.show_roms(self.state['all_roms'])
+        # NOTE: leave the cursor on the first match in the whole list
+        if matches:
+            self.select_game(matches[0])
+
+    def focus_picker(self):
+        if self.state['query'] is None:
+            return
+        self.set_state({
+            'select': -1,
+            'page': 0,
+        })
+
+    def next_char(self):
+        self.set_state({
+            'picker': (self.state['picker'] + 1) % len(PICKER_CHARS),
+        })
+
+    def prev_char(self):
+        self.set_state({
+            'picker': (self.state['picker'] - 1) % len(PICKER_CHARS),
+        })
+
+    def type_char(self):
+        self.set_query(
+            self.state['query'] + PICKER_CHARS[self.state['picker']])
+
+    def delete_char(self):
+        if not self.state['query']:
+            self.stop_search()
+            return
+        self.set_query(self.state['query'][:-1])
+
+    def set_query(self, query):
+        self.set_state({
+            'query': query,
+            'page': 0,
+        })
+        self.update_search()
+
+    def update_search(self):
+        roms = self.state['all_roms']
+        if not self.state['query']:
+            self.show_roms(roms)
+            return
+        builder = self.build_search_index()
+        if builder.index is not None:
+            self.show_roms(builder.index.search(self.state['query']))
+
+    def build_search_index(self):
+        """
+        Build the search index of the list in the background. The list
+        changes on every poll of a scan, only one build runs at a time and
+        the latest list is indexed once it is done.
+        """
+        roms = self.state['all_roms']
+        builder = self.search_builder
+        if builder is None or \
+                (builder.index is not None and builder.roms is not roms):
+            builder = self.search_builder = SearchIndexBuilder(roms)
+            self.app.add_timer(SEARCH_POLL_DELAY,
+                partial(self.poll_search, builder))
+        return builder
+
+    def poll_search(self, builder):
+        if builder is not self.search_builder:
+            return
+        if builder.index is None:
+            self.app.add_timer(SEARCH_POLL_DELAY,
+                partial(self.poll_search, builder))
+            return
+        if self.state['query']:
+            self.show_roms(builder.index.search(self.state['query']))
+        if builder.roms is not self.state['all_roms']:
+            self.build_search_index()
+
     def next_emulator(self):
         self.props['on_next_emulator']()
 
     def prev_emulator(self):
         self.props['on_prev_emulator']()
 
+    def source(self, game):
+        """
+        Return the directory a rom of the list comes from.
+        """
+        roms = self.state['all_roms']
+        if not isinstance(roms, MergedList):
+            return self.jobs[0].index.path
+        index = bisect_left(roms, game)
+        return self.jobs[roms.origins[index]].index.path
+
     def run_emulator(self):
         if not self.state['roms']:
             return
         try:
-            self.app.run_emulator(
-                self.props,
-                os.path.expanduser(self.props['path']),
-                self.game)
+            self.app.run_emulator(self.props, self.source(self.game), self.game)
         except MissingControls as exc:
             self.set_state({
                 'error': exc.message,
@@ -121,61 +336,224 @@ class ListRoms(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
         })
 
     def update_list(self):
-        includes = [
-            re.compile(fnmatch.translate(x))
-            for x in (
-                self.props['include'].split(';')
-                if self.props.get('include')
-                else []
-            )
-        ]
-        excludes = [
-            re.compile(fnmatch.translate(x))
-            for x in (
-                self.props['exclude'].split(';')
-                if self.props.get('exclude')
-                else []
-            )
-        ]
-        roms = sorted(filter(
-            lambda x: (not any(y.match(x) for y in excludes) or
-                any(y.match(x) for y in includes)),
-            os.listdir(os.path.expanduser(self.props['path']))))
+        self.stop_watchers()
+        self.jobs = self.app.scan_roms(self.props, foreground=True)
+        self.pending = set(range(len(self.jobs)))
         self.set_state({
-            'roms': roms,
-            'last_page': ceil(len(roms) / self.props['page_size']) - 1,
+            'sources': [[] for _ in self.jobs],
+            'all_roms': [],
+            'roms': [],
+            'last_page': -1,
             'select': -1,
             'page': 0,
             'error': None,
+            'scanning': True,
+            'found': [0] * len(self.jobs),
+        })
+        self.poll_scan()
+
+    def poll_scan(self):
+        sources = list(self.state['sources'])
+        found = list(self.state['found'])
+        changed = False
+        for i in sorted(self.pending):
+            job = self.jobs[i]
+            if job.done:
+                self.app.scan_pool.release(job)
+                self.pending.discard(i)
+                sources[i] = job.roms
+                found[i] = len(job.roms)
+                # NOTE: the names found are not needed anymore once the
+                #       result is read
+                job.found = []
+                changed = True
+                continue
+            count = len(job.found)
+            if count <= found[i]:
+                continue
+            # NOTE: the pages of a single directory fill in as the roms are
+            #       found, several directories are merged once per finished
+            #       scan instead of on every poll
+            if len(self.jobs) == 1:
+                # NOTE: both parts are already sorted, timsort merges them
+                #       in linear time
+                roms = sources[i] + sorted(job.found[found[i]:count])
+                roms.sort()
+                sources[i] = roms
+                changed = True
+            found[i] = count
+        if found != self.state['found']:
+            self.set_state({
+                'found': found,
+            })
+        if changed:
+            self.set_sources(sources)
+        if self.pending:
+            self.app.add_timer(SCAN_POLL_DELAY, self.poll_scan)
+            return
+        self.set_state({
+            'scanning': False,
+            'error': (
+                "Could not read the rom directory"
+                if any(x.error for x in self.jobs) else None),
+        })
+        # NOTE: ready before the first character is typed
+        self.build_search_index()
+        if self.app.settings.get('watch_roms'):
+            for i, job in enumerate(self.jobs):
+                if not job.error:
+                    self.start_watcher(i)
+
+    def select_game(self, game):
+        index = bisect_left(self.state['roms'], game)
+        if index < len(self.state['roms']) and \
+                self.state['roms'][index] == game:
+            self.select_index(index)
+
+    def jump_to_game(self, game):
+        if self.state['query'] is not None:
+            self.stop_search()
+        self.select_game(game)
+
+    def stop_watchers(self):
+        for watcher in self.watchers:
+            watcher.close()
+        self.watchers = []
+
+    def start_watcher(self, source):
+        index = self.jobs[source].index
+        try:
+            watcher = DirectoryWatcher(index.path, index.accept, index.dirs)
+        except (OSError, AttributeError) as exc:
+            self.logger.warning("Could not watch %s: %s", index.path, exc)
+            return
+        self.watchers.append(watcher)
+        self.app.add_timer(WATCH_POLL_DELAY,
+            partial(self.poll_watcher, watcher, source))
+
+    def poll_watcher(self, watcher, source):
+        if watcher not in self.watchers:
+            return
+        index = self.jobs[source].index
+        changes = watcher.changes()
+        if watcher.overflow:
+            self.logger.debug("Too many changes in %s, rescanning",
+                index.path)
+            self.update_list()
+            return
+        if changes:
+            added, removed, removed_dirs = changes
+            stale = added.union(removed)
+            for name in list(stale):
+                stale.update(index.members(name))
+            added = index.expand_added(added)
+            prefixes = tuple(x + os.sep for x in removed_dirs)
+            sources = list(self.state['sources'])
+            roms = [
+                x for x in sources[source]
+                if x not in stale and not (prefixes and x.startswith(prefixes))
+            ]
+            self.logger.debug("%s: %d roms added, %d removed",
+                index.path, len(added), len(sources[source]) - len(roms))
+            # NOTE: only the list of this directory is rebuilt, the merge
+            #       refers to the lists of the others without sorting or
+            #       copying them
+            sources[source] = CompactList(merge(roms, sorted(added)))
+            self.set_sources(sources)
+            self.build_search_index()
+            self.app.update_database('update', self.props['console'],
+                index.path, added, removed, removed_dirs)
+        self.app.add_timer(WATCH_POLL_DELAY,
+            partial(self.poll_watcher, watcher, source))
+
+    def set_sources(self, sources):
+        self.set_state({
+            'sources': sources,
         })
+        self.set_roms(merge_roms(sources))
+
+    def set_roms(self, roms):
+        self.set_state({
+            'all_roms': roms,
+        })
+        if self.state['query'] is not None:
+            self.update_search()
+        else:
+            self.show_roms(roms)
+
+    def show_roms(self, roms):
+        page_size = self.props['page_size']
+        select = self.state['select']
+        page = self.state['page']
+        if not roms:
+            page, select = 0, -1
+        elif select != -1:
+            # NOTE: keep the selected game under the cursor if it still
+            #       exists, otherwise keep the cursor where it was
+            game = self.game
+            index = bisect_left(roms, game)
+            if not (index < len(roms) and roms[index] == game):
+                index = min(page * page_size + select, len(roms) - 1)
+            page, select = divmod(index, page_size)
+        self.set_state({
+            'roms': roms,
+            'last_page': ceil(len(roms) / page_size) - 1,
+            'select': select,
+            'page': min(page, max(ceil(len(roms) / page_size) - 1, 0)),
+        })
+
+    def deactivate(self):
+        self.render_cache.release()
 
     def render(self):
         x, y = self.props['x'], self.props['y']
-        if self.state['select'] == -1:
-            with self.app.tint(self.props['highlight']):
-                self.app.write('font-12', x, y, "< %s >" % self.props['name'])
-        else:
-            self.app.write('font-12', x, y, "< %s >" % self.props['name'])
+        self.render_cache.draw((
+            self.state['roms'],
+            self.state['query'],
+            self.state['page'],
+            self.state['error'],
+            self.state['scanning'] and sum(self.state['found']),
+        ), self.compose)
+        # NOTE: the highlighted line is drawn over the cached page
+        if self.state['query'] is not None and self.state['select'] != -1:
+            self.app.write('font-12', x, y + self.props['line_space'],
+                self.picker)
+        with self.app.tint(self.props['highlight']):
+            if self.state['select'] == -1:
+                self.app.write('font-12', x, y, self.heading)
+                if self.state['query'] is not None:
+                    self.app.write('font-12',
+                        x, y + self.props['line_space'], self.picker)
+            else:
+                y += self.props['line_space'] * (self.state['select'] + 2)
+                self.app.write('font-12', x, y, self.game)
+
+    def compose(self):
+        x, y = self.props['x'], self.props['y']
+        self.app.write('font-12', x, y, self.heading)
         y += self.props['line_space'] * 2
         if not self.state['roms']:
-            self.app.write('font-12', x, y, "No rom found")
-            return
-        for i, rom in enumerate(islice(
-                self.state['roms'],
-                (self.props['page_size'] * self.state['page']),
-                (self.props['page_size'] * (self.state['page'] + 1)))):
-            if i == self.state['select']:
-                with self.app.tint(self.props['highlight']):
-                    self.app.write('font-12', x, y, rom)
+            if self.state['scanning']:
+                self.app.write('font-12', x, y, "Scanning... %d found"
+                    % sum(self.state['found']))
             else:
-                self.app.write('font-12', x, y, rom)
+                self.app.write('font-12', x, y, "No rom found")
+            if self.state['error']:
+                y += self.props['line_space']
+                with self.app.tint((0xff, 0x00, 0x00, 0xff)):
+                    self.app.write('font-12', x, y, self.state['error'])
+            return
+        start = self.props['page_size'] * self.state['page']
+        for rom in self.state['roms'][start:start + self.props['page_size']]:
+            self.app.write('font-12', x, y, rom)
             y += self.props['line_space']
         y += self.props['line_space']
         self.app.write('font-12', x, y,
-                "Page {} of {} ({} roms)".format(
+                "Page {} of {} ({} roms{})".format(
                 (self.state['page'] + 1),
                 self.state['last_page'] + 1,
-                len(self.state['roms'])))
+                len(self.state['roms']),
+                ", scanning..." if self.state['scanning'] else ""))
         if self.state['error']:
             y += self.props['line_space']
             with self.app.tint((0xff, 0x00, 0x00, 0xff)):
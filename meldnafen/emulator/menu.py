@@ -4,8 +4,12 @@ import sdl2
 import sdl2ui
 import sdl2ui.mixins
 
+from meldnafen.idle import InvalidateMixin
+from meldnafen.render_cache import RenderCache
 
-class Menu(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+
+class Menu(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def init(self):
         self.keyboard_mapping = {
             sdl2.SDL_SCANCODE_UP: self.previous_item,
@@ -15,10 +19,13 @@ class Menu(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
             sdl2.SDL_SCANCODE_ESCAPE: self.props['on_quit'],
         }
         self.register_event_handler(sdl2.SDL_KEYDOWN, self.keypress)
+        self.render_cache = RenderCache(self.app)
+        self.register_event_handler(
+            sdl2.SDL_RENDER_TARGETS_RESET, self.render_cache.invalidate)
 
-    def start(self, vars):
+    def start(self, vars, menu=None):
         self.set_state({
-            'root': self.props['menu'],
+            'root': menu or self.props['menu'],
             'previous': [],
             'select': 0,
             'vars': vars,
@@ -72,14 +79,31 @@ class Menu(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
                 'select': 0,
             })
 
+    def deactivate(self):
+        self.render_cache.release()
+
     def render(self):
+        # NOTE: only the labels depending on the app can change while the
+        #       menu is displayed, the others are formatted when composing
+        self.render_cache.draw((
+            self.state['root'],
+            self.state['vars'],
+        ) + tuple(
+            label.format(**self.state['vars'])
+            for label, _, _ in self.state['root']
+            if "{app" in label
+        ), self.compose)
+        x = self.props['x']
+        y = self.props['y'] + self.props['line_space'] * self.state['select']
+        with self.app.tint(self.props['highlight']):
+            self.app.write('font-12', x, y, self.labels[self.state['select']])
+
+    def compose(self):
         x, y = self.props['x'], self.props['y']
-        for i, (label, _, _) in enumerate(self.state['root']):
-            if i == self.state['select']:
-                with self.app.tint(self.props['highlight']):
-                    self.app.write('font-12', x, y,
-                        label.format(**self.state['vars']))
-            else:
-                self.app.write('font-12', x, y,
-                    label.format(**self.state['vars']))
+        self.labels = [
+            label.format(**self.state['vars'])
+            for label, _, _ in self.state['root']
+        ]
+        for label in self.labels:
+            self.app.write('font-12', x, y, label)
             y += self.props['line_space']
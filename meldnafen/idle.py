@@ -0,0 +1,100 @@
+from heapq import heappop, heappush
+from itertools import count
+import sdl2
+
+
+# NOTE: frames drawn after an event woke us up. The event is handled by the
+#       main loop after the tick returns, the second frame presents its
+#       changes whether the loop draws before or after running the timers
+WAKE_FRAMES = 2
+MAX_SLEEP = 1000
+
+
+class InvalidateMixin(object):
+    """
+    Redraw the screen in idle render mode when the state of a component or
+    its visibility changes.
+    """
+
+    def invalidate_frame(self):
+        # NOTE: the state is set before the idle renderer exists
+        idle_renderer = getattr(self.app, 'idle_renderer', None)
+        if idle_renderer:
+            idle_renderer.invalidate()
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.invalidate_frame()
+
+    def enable(self):
+        super().enable()
+        self.invalidate_frame()
+
+    def disable(self):
+        super().disable()
+        self.invalidate_frame()
+
+
+class IdleRenderer(object):
+    """
+    Sleep between the frames until an event arrives or the state changes.
+
+    The app timers are run by the renderer itself while it sleeps, a timer
+    that does not change the state does not draw a frame.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.timers = []
+        self.counter = count()
+        self.frames = WAKE_FRAMES
+
+    def start(self):
+        self.schedule()
+
+    def schedule(self):
+        # NOTE: this timer runs every frame, it is not run by the renderer
+        self.app.add_timer(0, self.tick, track=False)
+
+    def add_timer(self, delay, callback):
+        # NOTE: the counter keeps the callbacks out of the comparison and the
+        #       timers of the same deadline in order
+        heappush(self.timers,
+            (sdl2.SDL_GetTicks() + delay, next(self.counter), callback))
+
+    def run_timers(self):
+        now = sdl2.SDL_GetTicks()
+        due = []
+        # NOTE: the timers added by the callbacks run on the next pass
+        while self.timers and self.timers[0][0] <= now:
+            due.append(heappop(self.timers)[2])
+        for callback in due:
+            callback()
+
+    def invalidate(self):
+        self.frames = WAKE_FRAMES
+
+    def tick(self):
+        self.schedule()
+        self.run_timers()
+        # NOTE: the debugger displays the frame rate, keep it accurate
+        if self.app.debug_mode:
+            return
+        if self.frames > 0:
+            self.frames -= 1
+            return
+        start = sdl2.SDL_GetTicks()
+        while self.frames == 0:
+            now = sdl2.SDL_GetTicks()
+            # NOTE: give the hand back to the main loop from time to time
+            timeout = MAX_SLEEP - (now - start)
+            if timeout <= 0:
+                return
+            if self.timers:
+                timeout = min(timeout, self.timers[0][0] - now)
+            # NOTE: wait without removing the event from the queue, the main
+            #       loop handles it as usual as soon as we return
+            if sdl2.SDL_WaitEventTimeout(None, max(timeout, 0)):
+                self.invalidate()
+                return
+            self.run_timers()
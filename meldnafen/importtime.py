@@ -0,0 +1,109 @@
+import argparse
+import re
+import subprocess
+import sys
+
+
+# NOTE: budgets in milliseconds on a desktop computer, the package is
+#       imported again after every game when the launcher is not resident
+BUDGETS = {
+    'meldnafen': 40.0,
+    'meldnafen.app': 300.0,
+}
+
+# NOTE: modules that must only be loaded when their feature is used
+LAZY_MODULES = {
+    'meldnafen': [
+        'sdl2', 'sdl2ui', 'subprocess', 'tempfile',
+        'meldnafen.consoles', 'meldnafen.retroarch', 'meldnafen.roms.index',
+    ],
+    'meldnafen.app': [
+        'vgmplayer', 'sdl2ui.mixer', 'sdl2ui.debugger', 'meldnafen.vgm',
+        'meldnafen.memory', 'meldnafen.roms.checksum',
+        'meldnafen.roms.database', 'multiprocessing', 'sqlite3',
+        'xml.etree.ElementTree', 'py7zr',
+    ],
+}
+
+LINE_REGEX = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure(module):
+    """
+    Import a module in a new interpreter and return the self and cumulative
+    time in microseconds of every module loaded by the import.
+    """
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', "import %s" % module],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError("Could not import %s:\n%s"
+            % (module, process.stderr.strip().splitlines()[-1]))
+    # NOTE: the parent packages are imported at the top level before the
+    #       module itself, the interpreter startup is listed there too
+    parts = module.split('.')
+    roots = set('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    timings, pending = {}, {}
+    for line in process.stderr.splitlines():
+        match = LINE_REGEX.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        pending[name] = (int(match.group(1)), int(match.group(2)))
+        # NOTE: a module is listed after everything it imported
+        if len(match.group(3)) == 1:
+            if name in roots:
+                timings.update(pending)
+            pending = {}
+    return timings, sum(timings[x][1] for x in roots if x in timings) / 1000
+
+
+def check(module, budget, runs=5):
+    best = None
+    for _ in range(runs):
+        timings, elapsed = measure(module)
+        if best is None or elapsed < best[0]:
+            best = (elapsed, timings)
+    elapsed, timings = best
+    errors = []
+    loaded = [x for x in LAZY_MODULES.get(module, []) if x in timings]
+    if loaded:
+        errors.append("loaded eagerly: %s" % ", ".join(loaded))
+    if budget is not None and elapsed > budget:
+        errors.append("%.1f ms over the budget of %.1f ms" % (elapsed, budget))
+    print("%s: %.1f ms" % (module, elapsed))
+    if errors:
+        for error in errors:
+            print("  %s" % error)
+        heaviest = sorted(timings.items(), key=lambda x: -x[1][0])[:10]
+        print("  heaviest modules (self time):")
+        for name, (self_time, _) in heaviest:
+            print("  %10.1f ms  %s" % (self_time / 1000, name))
+    return not errors
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m meldnafen.importtime",
+        description="fail if importing meldnafen exceeds its time budget")
+    parser.add_argument('modules', nargs='*', default=sorted(BUDGETS),
+        help="modules to check (default: %(default)s)")
+    parser.add_argument('--budget', type=float, metavar='MS',
+        help="override the budget of every module")
+    parser.add_argument('--runs', type=int, default=5,
+        help="the fastest of RUNS imports is kept (default: %(default)s)")
+    opts = parser.parse_args()
+    ok = True
+    for module in opts.modules:
+        budget = opts.budget if opts.budget is not None \
+            else BUDGETS.get(module)
+        try:
+            ok = check(module, budget, opts.runs) and ok
+        except RuntimeError as exc:
+            print(exc)
+            ok = False
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
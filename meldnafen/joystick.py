@@ -1,10 +1,61 @@
 import logging
+import re
 import sdl2
 import sdl2ui
 import sdl2ui.mixins
 
+from meldnafen.idle import InvalidateMixin
 
-class MenuJoystick(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
+
+BINDING_REGEX = re.compile(
+    r"^(?:(?P<button>\d+)|(?P<sign>[+-])(?P<axis>\d+)"
+    r"|h(?P<hat>\d+)(?P<direction>up|down|left|right))$")
+
+HAT_DIRECTIONS = {
+    'up': sdl2.SDL_HAT_UP,
+    'down': sdl2.SDL_HAT_DOWN,
+    'left': sdl2.SDL_HAT_LEFT,
+    'right': sdl2.SDL_HAT_RIGHT,
+}
+HAT_VALUES = frozenset(HAT_DIRECTIONS.values())
+
+
+def axis_code(axis, positive):
+    return axis << 1 | positive
+
+
+def hat_code(hat, value):
+    # NOTE: the SDL hat values are bit flags on 4 bits
+    return hat << 4 | value
+
+
+class KeyTable(object):
+    """
+    A joystick mapping compiled to integer keyed tables so events can be
+    dispatched without formatting any string.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, mapping):
+        self.buttons = {}
+        self.axes = {}
+        self.hats = {}
+        for binding, key in mapping.items():
+            match = BINDING_REGEX.match(binding)
+            if not match:
+                self.logger.warning("Invalid joystick binding: %s", binding)
+            elif match.group('button'):
+                self.buttons[int(match.group('button'))] = key
+            elif match.group('axis'):
+                self.axes[axis_code(int(match.group('axis')),
+                    match.group('sign') == "+")] = key
+            else:
+                self.hats[hat_code(int(match.group('hat')),
+                    HAT_DIRECTIONS[match.group('direction')])] = key
+
+
+class MenuJoystick(
+        InvalidateMixin, sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     logger = logging.getLogger(__name__)
 
     def init(self):
@@ -45,7 +96,7 @@ class MenuJoystick(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
         joystick.open()
         self.joysticks[joystick.id] = joystick
         keyboard_mapping = self.state['keyboard_mapping'].copy()
-        keyboard_mapping[joystick.id] = mapping
+        keyboard_mapping[joystick.id] = KeyTable(mapping)
         self.set_state({
             'keyboard_mapping': keyboard_mapping,
         })
@@ -59,10 +110,10 @@ class MenuJoystick(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
     def button_down(self, event):
         if event.jbutton.which not in self.joysticks:
             return
-        mapping = self.state['keyboard_mapping'].get(event.jbutton.which)
-        if not mapping:
+        table = self.state['keyboard_mapping'].get(event.jbutton.which)
+        if not table:
             return
-        key = mapping.get(str(event.jbutton.button))
+        key = table.buttons.get(event.jbutton.button)
         if key:
             self.app.keys[key] = sdl2.SDL_TRUE
             self._push_keyboard_event(key)
@@ -73,49 +124,52 @@ class MenuJoystick(sdl2ui.Component, sdl2ui.mixins.ImmutableMixin):
                 self.joysticks[event.jbutton.which].index)
 
     def axis_motion(self, event):
-        if event.jbutton.which not in self.joysticks:
+        if event.jaxis.which not in self.joysticks:
             return
-        mapping = self.state['keyboard_mapping'].get(event.jaxis.which)
-        if not mapping:
+        table = self.state['keyboard_mapping'].get(event.jaxis.which)
+        if not table:
             return
         value = event.jaxis.value
         if value < -0x4000:
-            self.axis_change[event.jaxis.which] = "-{}".format(event.jaxis.axis)
+            self.axis_change[event.jaxis.which] = \
+                axis_code(event.jaxis.axis, False)
         elif value >= 0x4000:
-            self.axis_change[event.jaxis.which] = "+{}".format(event.jaxis.axis)
-        elif value == 0 and self.axis_change.get(event.jaxis.which):
-            key = mapping.get(self.axis_change[event.jaxis.which])
+            self.axis_change[event.jaxis.which] = \
+                axis_code(event.jaxis.axis, True)
+        elif value == 0 and self.axis_change.get(event.jaxis.which) \
+                is not None:
+            code = self.axis_change[event.jaxis.which]
+            key = table.axes.get(code)
             if key:
                 self.app.keys[key] = sdl2.SDL_TRUE
                 self._push_keyboard_event(key)
             else:
                 self.logger.debug(
-                    "Axis %s on joystick %d not mapped",
-                    self.axis_change[event.jaxis.which], self.joysticks[event.jaxis.which].index)
+                    "Axis %s%d on joystick %d not mapped",
+                    "+" if code & 1 else "-", code >> 1,
+                    self.joysticks[event.jaxis.which].index)
             self.axis_change[event.jaxis.which] = None
 
     def hat_motion(self, event):
         if event.jhat.which not in self.joysticks:
             return
-        mapping = self.state['keyboard_mapping'].get(event.jhat.which)
-        if not mapping:
+        table = self.state['keyboard_mapping'].get(event.jhat.which)
+        if not table:
             return
         value = event.jhat.value
-        if value == sdl2.SDL_HAT_UP:
-            self.hat_change[event.jhat.which] = "h{}up".format(event.jhat.hat)
-        elif value == sdl2.SDL_HAT_DOWN:
-            self.hat_change[event.jhat.which] = "h{}down".format(event.jhat.hat)
-        elif value == sdl2.SDL_HAT_LEFT:
-            self.hat_change[event.jhat.which] = "h{}left".format(event.jhat.hat)
-        elif value == sdl2.SDL_HAT_RIGHT:
-            self.hat_change[event.jhat.which] = "h{}right".format(event.jhat.hat)
-        elif value == sdl2.SDL_HAT_CENTERED and self.hat_change:
-            key = mapping.get(self.hat_change[event.jhat.which])
+        if value in HAT_VALUES:
+            self.hat_change[event.jhat.which] = \
+                hat_code(event.jhat.hat, value)
+        elif value == sdl2.SDL_HAT_CENTERED and \
+                self.hat_change.get(event.jhat.which) is not None:
+            code = self.hat_change[event.jhat.which]
+            key = table.hats.get(code)
             if key:
                 self.app.keys[key] = sdl2.SDL_TRUE
                 self._push_keyboard_event(key)
             else:
                 self.logger.debug(
-                    "Hat %s on joystick %d not mapped",
-                    self.hat_change[event.jhat.which], self.joysticks[event.jhat.which].index)
+                    "Hat %d value %d on joystick %d not mapped",
+                    code >> 4, code & 0xf,
+                    self.joysticks[event.jhat.which].index)
             self.hat_change[event.jhat.which] = None
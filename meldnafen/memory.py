@@ -0,0 +1,41 @@
+import resource
+import sdl2ui
+
+from meldnafen.roms.compact import memory_usage
+
+
+class MemoryStats(sdl2ui.Component):
+    """
+    Debug overlay showing the memory used by the lists of roms, the peak
+    RSS of the process and the underruns of the live audio.
+    """
+
+    def init(self):
+        self.usage = ((), 0)
+
+    def roms_usage(self):
+        lists = tuple(
+            emulator.list.state['all_roms']
+            for emulator in self.app.emulators
+            if emulator is not None)
+        # NOTE: computed once per set of lists, summing the size of a list
+        #       of str takes a while
+        cached, usage = self.usage
+        if len(cached) != len(lists) or \
+                any(x is not y for x, y in zip(cached, lists)):
+            usage = sum(memory_usage(x) for x in lists)
+            self.usage = (lists, usage)
+        return usage
+
+    def render(self):
+        # NOTE: in KB on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.app.write('font-12', self.props['x'], self.props['y'],
+            "Roms: {} KB, peak RSS: {} MB".format(
+                self.roms_usage() // 1024, rss // 1024))
+        # NOTE: counted by the VGM player, not by the mixer
+        underruns = getattr(self.app.bgm, 'underruns', None)
+        if underruns is not None:
+            self.app.write('font-12', self.props['x'],
+                self.props['y'] + self.props['line_space'],
+                "Audio underruns: {}".format(underruns))
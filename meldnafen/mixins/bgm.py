@@ -1,44 +1,193 @@
-from itertools import chain
 import os
-import random
 import sdl2
 import sdl2ui
 
-from meldnafen.vgm import VgmPlayer, VgmFile
+from meldnafen.music import MusicCatalog, VGM_REGEX, read_vgm_loop
+from meldnafen.profiler import profiler
+from meldnafen.storage import cache_dir
+
+
+BGM_FREQUENCY = 44100
+# NOTE: format produced by the live VGM decoder
+BGM_FORMAT = sdl2.AUDIO_S16MSB
+BGM_CHANNELS = 2
+BGM_FRAME_SIZE = BGM_CHANNELS * 2
+# NOTE: in milliseconds, the next track is rendered once the menu is idle
+BGM_RENDER_DELAY = 15000
 
 
 class BgmMixin:
     def init(self):
-        filepath = self.pick_random_bgm()
-        if filepath:
+        self.music_catalog = None
+        self.bgm_renderer = None
+        self.mixer = None
+        self.bgm = self.add_bgm()
+
+    def add_bgm(self):
+        with profiler.phase("pick_random_bgm"):
+            filepath = self.pick_random_bgm()
+        # NOTE: the audio modules are only imported for the format that is
+        #       played, importing them registers their resource type
+        if filepath and VGM_REGEX.match(filepath):
+            return self.add_vgm_bgm(filepath)
+        elif filepath:
+            return self.add_mixer_bgm(filepath)
+        else:
+            return self.add_component(sdl2ui.NullComponent)
+
+    def add_vgm_bgm(self, filepath):
+        import meldnafen.vgm
+        pcm_cache = self.get_pcm_cache()
+        if pcm_cache:
+            pcm = pcm_cache.lookup(filepath, sdl2.AUDIO_S16SYS)
+            if pcm:
+                self.logger.debug("Playing %s from the PCM cache", filepath)
+                return self.add_vgm_player(
+                    format=sdl2.AUDIO_S16SYS,
+                    pcm=pcm,
+                    loop_start=self.get_loop_start(filepath))
+        with profiler.phase("bgm load"):
             self.load_resource('bgm', filepath)
         if 'bgm' not in self.resources:
-            self.bgm = self.add_component(sdl2ui.NullComponent)
-        elif isinstance(self.resources['bgm'], VgmFile):
-            self.bgm = self.add_component(VgmPlayer,
-                resource='bgm',
-                frequency=44100,
-                format=sdl2.AUDIO_S16MSB,
-                channels=2,
-                chunksize=4096)
-        else:
-            self.mixer = self.add_component(Mixer)
-            self.bgm = self.mixer.open('bgm', loops=-1)
+            return self.add_component(sdl2ui.NullComponent)
+        # NOTE: the samples are swapped to the native byte order by the
+        #       producer thread, SDL would convert them in the audio callback
+        return self.add_vgm_player(
+            format=sdl2.AUDIO_S16SYS,
+            swap=(BGM_FORMAT != sdl2.AUDIO_S16SYS),
+            resource='bgm')
+
+    def add_mixer_bgm(self, filepath):
+        from sdl2ui.mixer import Mixer
+        with profiler.phase("bgm load"):
+            self.load_resource('bgm', filepath)
+        if 'bgm' not in self.resources:
+            return self.add_component(sdl2ui.NullComponent)
+        self.mixer = self.add_component(Mixer)
+        return self.mixer.open('bgm', loops=-1)
+
+    def add_vgm_player(self, **kwargs):
+        from meldnafen.vgm import VgmPlayer
+        return self.add_component(VgmPlayer,
+            frequency=BGM_FREQUENCY,
+            channels=BGM_CHANNELS,
+            chunksize=4096,
+            **kwargs)
+
+    def get_loop_start(self, filepath):
+        try:
+            total, loop = read_vgm_loop(filepath)
+        except (OSError, ValueError):
+            return 0
+        return (total - loop) * BGM_FRAME_SIZE
+
+    def get_pcm_cache(self):
+        if not self.settings.get('bgm_cache_size'):
+            return None
+        from meldnafen.vgm import PcmCache
+        return PcmCache(
+            cache_dir(self.settings, 'pcm'),
+            size=self.settings['bgm_cache_size'] * 1024 * 1024,
+            length=(self.settings['bgm_cache_seconds'] *
+                BGM_FREQUENCY * BGM_FRAME_SIZE))
+
+    def schedule_bgm_render(self):
+        if self.music_catalog and self.settings.get('bgm_cache_size'):
+            self.add_timer(BGM_RENDER_DELAY, self.start_bgm_render)
+
+    def start_bgm_render(self):
+        # NOTE: the track played next is rendered while this one plays, it
+        #       is served from the cache on the next start
+        if self.bgm_renderer and self.bgm_renderer.is_alive():
+            return
+        filepath = self.music_catalog.peek()
+        if not filepath or not VGM_REGEX.match(filepath):
+            return
+        pcm_cache = self.get_pcm_cache()
+        if pcm_cache.lookup(filepath, sdl2.AUDIO_S16SYS):
+            return
+        try:
+            total, _ = read_vgm_loop(filepath)
+        except (OSError, ValueError) as exc:
+            self.logger.warning("Could not render track: %s", exc)
+            return
+        length = total * BGM_FRAME_SIZE
+        if not length or length > pcm_cache.length:
+            self.logger.debug("Track not rendered, too long: %s", filepath)
+            return
+        from meldnafen.vgm import PcmRenderer
+        try:
+            recorder = pcm_cache.recorder(filepath, sdl2.AUDIO_S16SYS, length)
+        except OSError as exc:
+            self.logger.warning("Could not render track: %s", exc)
+            return
+        self.logger.debug("Rendering %s in the PCM cache", filepath)
+        self.bgm_renderer = PcmRenderer(recorder, filepath,
+            swap=(BGM_FORMAT != sdl2.AUDIO_S16SYS))
+        self.bgm_renderer.start()
+
+    def stop_bgm_render(self):
+        # NOTE: the partial file is removed, the track is rendered again
+        #       later
+        if self.bgm_renderer:
+            self.bgm_renderer.stop()
+            self.bgm_renderer = None
 
     def activate(self):
         self.bgm.enable()
+        self.schedule_bgm_render()
+
+    def pause_bgm(self):
+        self.bgm.disable()
+
+    def unpause_bgm(self):
+        self.bgm.enable()
+
+    def stop_bgm(self):
+        self.stop_bgm_render()
+        self.remove_bgm()
+        # NOTE: closes every audio device
+        sdl2.SDL_QuitSubSystem(sdl2.SDL_INIT_AUDIO)
+
+    def remove_bgm(self):
+        # NOTE: the live decoder and its producer are threads of their own,
+        #       the cached track is an mmap
+        self.remove_component(self.bgm)
+        if hasattr(self.bgm, 'unload'):
+            self.bgm.unload()
+        self.bgm = None
+        if self.mixer is not None:
+            from sdl2 import sdlmixer
+            sdlmixer.Mix_HaltMusic()
+        resource = self.resources.pop('bgm', None)
+        if resource is not None:
+            resource.close()
+        if self.mixer is not None:
+            # NOTE: the next track opens a mixer of its own
+            self.remove_component(self.mixer)
+            sdlmixer.Mix_CloseAudio()
+            self.mixer = None
+
+    def remove_component(self, component):
+        # NOTE: the music of the mixer is a component of the mixer itself
+        component.disable()
+        if component in self.components:
+            self.components.remove(component)
+
+    def restart_bgm(self):
+        sdl2.SDL_InitSubSystem(sdl2.SDL_INIT_AUDIO)
+        # NOTE: a new track is picked
+        self.bgm = self.add_bgm()
+        self.bgm.enable()
+        self.schedule_bgm_render()
 
     def pick_random_bgm(self):
         if not self.settings.get('musics'):
             return None
         musics_dir = os.path.expanduser(self.settings['musics'])
-        if not (os.path.exists(musics_dir) and os.listdir(musics_dir)):
+        if not os.path.isdir(musics_dir):
             return None
-        else:
-            return random.choice(
-                list(chain.from_iterable(
-                    map(
-                        lambda x: map(
-                            lambda y: os.path.join(x[0], y),
-                            x[2]),
-                        os.walk(musics_dir)))))
+        if self.music_catalog is None:
+            self.music_catalog = MusicCatalog(
+                musics_dir, cache_dir(self.settings, 'bgm'))
+        return self.music_catalog.pick()
@@ -12,8 +12,14 @@ JOYSTICK_ACTIONS = {
     'run': sdl2.SDL_SCANCODE_RETURN,
     'cancel': sdl2.SDL_SCANCODE_BACKSPACE,
     'menu': sdl2.SDL_SCANCODE_ESCAPE,
+    'next_letter': sdl2.SDL_SCANCODE_PAGEDOWN,
+    'prev_letter': sdl2.SDL_SCANCODE_PAGEUP,
+    'search': sdl2.SDL_SCANCODE_SLASH,
 }
 
+# NOTE: configurations made before these actions existed are still valid
+OPTIONAL_JOYSTICK_ACTIONS = {'next_letter', 'prev_letter', 'search'}
+
 
 class ControlsMixin:
     def init(self):
@@ -23,6 +29,9 @@ class ControlsMixin:
         self.joystick_configure = self.add_component(Controls,
             line_space=10,
             cancellable=False,
+            # NOTE: the menu actions are looked up by input, an input bound
+            #       twice would silently lose one of them
+            unique=True,
             countdown=8,
             on_finish=self.finish_joystick_configuration,
             controls=[
@@ -33,6 +42,9 @@ class ControlsMixin:
                 ('run', "Run/Start"),
                 ('cancel', "Cancel"),
                 ('menu', "Menu"),
+                ('next_letter', "Next letter", True),
+                ('prev_letter', "Previous letter", True),
+                ('search', "Search", True),
             ],
             x=self.x,
             y=self.y)
@@ -69,11 +81,17 @@ class ControlsMixin:
             re.sub(r"(_btn|_axis)$", "", k): v
             for k, v in controls.items()
         }
-        if set(JOYSTICK_ACTIONS) - set(key_bindings):
+        if set(JOYSTICK_ACTIONS) - OPTIONAL_JOYSTICK_ACTIONS - \
+                set(key_bindings):
             return False
+        # NOTE: the required actions win over the optional ones bound to the
+        #       same input by older configurations
+        actions = sorted(JOYSTICK_ACTIONS,
+            key=lambda x: x not in OPTIONAL_JOYSTICK_ACTIONS)
         self.joystick.load(joystick, {
-            key_bindings[action]: key
-            for action, key in JOYSTICK_ACTIONS.items()
+            key_bindings[action]: JOYSTICK_ACTIONS[action]
+            for action in actions
+            if action in key_bindings
         })
         return True
 
@@ -1,8 +1,22 @@
+from functools import partial
 import os
 
 from meldnafen.consoles import consoles
 from meldnafen.exceptions import MissingControls
 from meldnafen.emulator import Emulator
+from meldnafen.roms.index import RomIndex, rom_paths
+from meldnafen.roms.pool import (
+    PRIORITY_BACKGROUND, PRIORITY_FOREGROUND, shared_pool)
+from meldnafen.storage import cache_dir
+
+
+PRELOAD_DELAY = 500
+# NOTE: leave some time to the scans started with the app
+CHECKSUM_DELAY = 10000
+# NOTE: in seconds, the worker checks if it is stopped at least every
+#       second, it is a daemon thread that does not hold the exit anyway
+CHECKSUM_STOP_TIMEOUT = 2
+SCAN_WORKERS = 4
 
 
 def merge_dict(*dicts):
@@ -18,8 +32,56 @@ class EmulatorMixin(object):
             'emulator': 0,
             'command': None,
         })
-        self.emulators = [
-            self.add_component(Emulator,
+        self.emulators = [None] * len(self.settings['emulators'])
+        self.checksum_worker = None
+        # NOTE: scan every console in the background right away, the
+        #       visible one is moved to the front of the queue when built
+        self.scan_pool = shared_pool(SCAN_WORKERS)
+        for emulator in self.settings['emulators']:
+            self.scan_roms(merge_dict(consoles[emulator['console']], emulator))
+
+    def activate(self):
+        if self.emulators and self.settings.get('preload_emulators'):
+            self.add_timer(PRELOAD_DELAY,
+                partial(self.preload_emulators, self.state['emulator']))
+        self.schedule_checksums()
+
+    def schedule_checksums(self):
+        if self.settings.get('database') and \
+                self.settings.get('checksum_roms'):
+            self.add_timer(CHECKSUM_DELAY, self.start_checksums)
+
+    def start_checksums(self):
+        if self.checksum_worker:
+            return
+        # NOTE: the worker loads multiprocessing and the XML parser, it is
+        #       only imported when it starts
+        from meldnafen.roms.checksum import ChecksumWorker
+        self.checksum_worker = ChecksumWorker(self.settings['database'], {
+            emulator['console']: emulator['dat']
+            for emulator in self.settings['emulators']
+            if emulator.get('dat')
+        })
+        self.checksum_worker.start()
+
+    def stop_checksums(self):
+        # NOTE: the checksums computed so far are saved, the next run
+        #       resumes from there
+        if self.checksum_worker:
+            self.checksum_worker.stop()
+            self.checksum_worker.join(CHECKSUM_STOP_TIMEOUT)
+            if self.checksum_worker.is_alive():
+                self.logger.warning("The checksum worker did not stop")
+            self.checksum_worker = None
+
+    @property
+    def emulator(self):
+        return self.get_emulator(self.state['emulator'])
+
+    def get_emulator(self, index):
+        if self.emulators[index] is None:
+            emulator = self.settings['emulators'][index]
+            self.emulators[index] = self.add_component(Emulator,
                 border=10,
                 page_size=15,
                 line_space=10,
@@ -28,12 +90,61 @@ class EmulatorMixin(object):
                 y=self.y,
                 on_next_emulator=self.next_emulator,
                 on_prev_emulator=self.prev_emulator,
-                on_menu_activated=self.bgm.disable,
-                on_menu_deactivated=self.bgm.enable,
+                on_menu_activated=self.pause_bgm,
+                on_menu_deactivated=self.unpause_bgm,
                 **merge_dict(consoles[emulator['console']], emulator.items()))
-            for emulator in self.settings['emulators']
+        return self.emulators[index]
+
+    def preload_emulators(self, index):
+        # NOTE: build the neighbours one at a time so a single idle timer
+        #       never blocks the UI for more than one emulator
+        for offset in (1, -1):
+            neighbour = (index + offset) % len(self.emulators)
+            if self.emulators[neighbour] is None:
+                self.get_emulator(neighbour)
+                self.add_timer(PRELOAD_DELAY,
+                    partial(self.preload_emulators, index))
+                return
+
+    def scan_roms(self, emulator, foreground=False):
+        # NOTE: the directories of a console are scanned concurrently by the
+        #       workers of the pool
+        return [
+            self.scan_path(emulator, path, foreground)
+            for path in rom_paths(emulator['path'])
         ]
 
+    def scan_path(self, emulator, path, foreground=False):
+        index = RomIndex(
+            path,
+            include=emulator.get('include'),
+            exclude=emulator.get('exclude'),
+            cache=cache_dir(self.settings, 'roms'),
+            archives=emulator.get('archives', False))
+        on_done = None
+        if self.settings.get('database'):
+            from meldnafen.roms.database import sync_database
+            on_done = partial(sync_database,
+                self.settings['database'], emulator['console'], index.path)
+        return self.scan_pool.submit(index,
+            PRIORITY_FOREGROUND if foreground else PRIORITY_BACKGROUND,
+            on_done)
+
+    def query_database(self, method, *args):
+        if not self.settings.get('database'):
+            return None
+        import sqlite3
+        from meldnafen.roms.database import RomDatabase
+        try:
+            with RomDatabase(self.settings['database']) as database:
+                return getattr(database, method)(*args)
+        except (sqlite3.Error, OSError) as exc:
+            self.logger.warning("Could not use the rom database: %s", exc)
+            return None
+
+    def update_database(self, method, *args):
+        self.query_database(method, *args)
+
     def get_player_controls(self, controls):
         self.joystick_manager.reload()
         config = {}
@@ -74,16 +185,32 @@ class EmulatorMixin(object):
                 self.settings['controls']['game'][console][game]))
         except KeyError:
             pass
+        self.update_database('record_play', path, game)
+        if self.settings.get('resident'):
+            from meldnafen.retroarch import prepare
+            self.run_resident(prepare(command, controls, self.settings))
+            return
         self.set_state({
             'command': command,
             'controls': controls,
         })
         self.quit()
 
+    def release_emulators(self):
+        # NOTE: the app may quit on an error before init
+        for emulator in getattr(self, 'emulators', []):
+            if emulator is not None:
+                emulator.list.stop_watchers()
+        if getattr(self, 'checksum_worker', None):
+            self.stop_checksums()
+
     def show_emulator(self, index):
-        self.emulators[self.state['emulator']].disable()
-        self.emulators[index].enable()
+        self.emulator.disable()
+        self.get_emulator(index).enable()
         self.set_state({'emulator': index})
+        if self.settings.get('preload_emulators'):
+            self.add_timer(PRELOAD_DELAY,
+                partial(self.preload_emulators, index))
 
     def toggle_smooth(self):
         self.set_state({
@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import logging
+from math import gcd
+import os
+import random
+import re
+import struct
+
+from meldnafen.roms.scanner import stamp, walk
+from meldnafen.storage import load_json, save_json
+
+
+CATALOG_VERSION = 1
+
+MUSIC_REGEX = re.compile(
+    r".*\.(vgm(\.gz)?|vgz|ogg|mp3|wav|flac|opus|mod|xm|it|s3m|midi?)$")
+VGM_REGEX = re.compile(r".*\.(vgm(\.gz)?|vgz)$")
+# NOTE: the sample counts of the header are at 44100 Hz whatever the chips
+VGM_HEADER_SIZE = 0x24
+
+
+def read_vgm_loop(filepath):
+    """
+    Return the number of samples of a VGM track played once (its intro and
+    one pass of its loop) and the number of samples of its loop, 0 if the
+    track does not loop.
+    """
+    with open(filepath, 'rb') as fh:
+        header = fh.read(VGM_HEADER_SIZE)
+    if header[:2] == b"\x1f\x8b":
+        with gzip.open(filepath, 'rb') as fh:
+            header = fh.read(VGM_HEADER_SIZE)
+    if len(header) < VGM_HEADER_SIZE or header[:4] != b"Vgm ":
+        raise ValueError("not a VGM file: %s" % filepath)
+    total, loop_offset, loop = struct.unpack_from("<III", header, 0x18)
+    return total, (loop if loop_offset else 0)
+
+
+class MusicCatalog(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, cache):
+        self.path = os.path.expanduser(path)
+        key = hashlib.sha1(self.path.encode('utf-8')).hexdigest()
+        self.filename = os.path.join(cache, "music-%s.json" % key)
+        self.queue_filename = os.path.join(cache, "queue-%s.json" % key)
+
+    def save(self, filename, data):
+        try:
+            save_json(filename, data)
+        except OSError as exc:
+            self.logger.warning("Could not save %s: %s", filename, exc)
+
+    def is_valid(self, catalog):
+        for relpath, old_stamp in catalog['dirs'].items():
+            try:
+                if stamp(os.path.join(self.path, relpath)) != old_stamp:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def load(self):
+        catalog = load_json(self.filename)
+        if (catalog and catalog.get('version') == CATALOG_VERSION and
+                self.is_valid(catalog)):
+            return catalog
+        self.logger.debug("Building music catalog: %s", self.path)
+        dirs = {}
+        catalog = {
+            'version': CATALOG_VERSION,
+            'tracks': sorted(
+                x for x in walk(self.path, lambda name: True, dirs)
+                if MUSIC_REGEX.match(x)),
+            'dirs': dirs,
+        }
+        self.save(self.filename, catalog)
+        return catalog
+
+    def new_cycle(self, size, last=None):
+        # NOTE: an affine map with a step coprime to the size is a
+        #       permutation, it is enough to store 3 integers to walk
+        #       through every track once in a random order
+        step = random.randrange(1, size) if size > 1 else 1
+        while gcd(step, size) != 1:
+            step = random.randrange(1, size)
+        offset = random.randrange(size)
+        if size > 1 and offset == last:
+            offset = (offset + 1) % size
+        return {
+            'size': size,
+            'step': step,
+            'offset': offset,
+            'position': 0,
+        }
+
+    def load_queue(self, size):
+        queue = load_json(self.queue_filename) or {}
+        if queue.get('size') != size or queue['position'] >= queue['size']:
+            # NOTE: saved right away so the track peeked is the one picked
+            queue = self.new_cycle(size, queue.get('last'))
+            self.save(self.queue_filename, queue)
+        return queue
+
+    def pick(self):
+        tracks = self.load()['tracks']
+        if not tracks:
+            return None
+        queue = self.load_queue(len(tracks))
+        index = (queue['offset'] + queue['step'] * queue['position']) \
+            % queue['size']
+        queue['position'] += 1
+        queue['last'] = index
+        self.save(self.queue_filename, queue)
+        return os.path.join(self.path, tracks[index])
+
+    def peek(self):
+        # NOTE: the track the next pick returns, the queue is unchanged
+        tracks = self.load()['tracks']
+        if not tracks:
+            return None
+        queue = self.load_queue(len(tracks))
+        index = (queue['offset'] + queue['step'] * queue['position']) \
+            % queue['size']
+        return os.path.join(self.path, tracks[index])
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+import json
+import logging
+import os
+import time
+
+
+class StartupProfiler(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self):
+        self.output = None
+        self.phases = []
+        self.pending = {}
+
+    @staticmethod
+    def clock():
+        return time.perf_counter(), time.process_time()
+
+    def record(self, name, start, end=None):
+        end = end or self.clock()
+        self.phases.append({
+            'phase': name,
+            'wall': end[0] - start[0],
+            'cpu': end[1] - start[1],
+        })
+
+    def begin(self, name):
+        self.pending[name] = self.clock()
+
+    def end(self, name):
+        start = self.pending.pop(name, None)
+        if start is not None:
+            self.record(name, start)
+
+    @contextmanager
+    def phase(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+    def table(self):
+        width = max([len(x['phase']) for x in self.phases] + [5])
+        lines = ["%-*s %10s %10s" % (width, "phase", "wall (ms)", "cpu (ms)")]
+        for x in self.phases:
+            lines.append("%-*s %10.1f %10.1f"
+                % (width, x['phase'], x['wall'] * 1000, x['cpu'] * 1000))
+        return "\n".join(lines)
+
+    def write(self):
+        if not self.output:
+            return
+        path = os.path.expanduser(self.output)
+        try:
+            with open(path, 'wt') as fh:
+                json.dump(self.phases, fh, indent=2)
+        except OSError as exc:
+            self.logger.error("Could not write startup profile: %s", exc)
+        else:
+            self.logger.info("Startup profile written to %s", path)
+        self.logger.info("Startup profile:\n%s", self.table())
+
+
+profiler = StartupProfiler()
@@ -0,0 +1,77 @@
+import ctypes
+import logging
+import sdl2
+
+
+class RenderCache(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, app):
+        self.app = app
+        self.key = None
+        self.texture = None
+        # NOTE: the renderer of the texture, it is destroyed with it
+        self.renderer = None
+        self.size = None
+        self.dst = None
+        self.failed = False
+
+    def invalidate(self, *args):
+        self.key = None
+
+    def release(self):
+        if self.texture and self.renderer is self.app.renderer:
+            sdl2.SDL_DestroyTexture(self.texture)
+        self.texture = None
+        self.key = None
+
+    def draw(self, key, compose):
+        if self.failed:
+            compose()
+            return
+        if self.texture is None or key != self.key or \
+                self.renderer is not self.app.renderer:
+            if not self.compose(compose):
+                compose()
+                return
+            self.key = key
+        sdl2.SDL_RenderCopy(self.app.renderer, self.texture, None, self.dst)
+
+    def compose(self, compose):
+        renderer = self.app.renderer
+        w, h = ctypes.c_int(), ctypes.c_int()
+        sdl2.SDL_GetRendererOutputSize(renderer, ctypes.byref(w),
+            ctypes.byref(h))
+        if self.size != (w.value, h.value) or self.renderer is not renderer:
+            self.release()
+        if self.texture is None:
+            self.texture = sdl2.SDL_CreateTexture(renderer,
+                sdl2.SDL_PIXELFORMAT_RGBA8888, sdl2.SDL_TEXTUREACCESS_TARGET,
+                w.value, h.value)
+            if not self.texture:
+                # NOTE: the renderer does not support render targets, draw
+                #       everything every frame like before
+                self.logger.warning("Could not create a render target: %s",
+                    sdl2.SDL_GetError())
+                self.texture = None
+                self.failed = True
+                return False
+            sdl2.SDL_SetTextureBlendMode(self.texture, sdl2.SDL_BLENDMODE_BLEND)
+            self.size = (w.value, h.value)
+            self.renderer = renderer
+        sx, sy = ctypes.c_float(), ctypes.c_float()
+        sdl2.SDL_RenderGetScale(renderer, ctypes.byref(sx), ctypes.byref(sy))
+        color = [ctypes.c_uint8() for _ in range(4)]
+        sdl2.SDL_GetRenderDrawColor(renderer, *map(ctypes.byref, color))
+        sdl2.SDL_SetRenderTarget(renderer, self.texture)
+        sdl2.SDL_RenderSetScale(renderer, sx, sy)
+        sdl2.SDL_SetRenderDrawColor(renderer, 0, 0, 0, 0)
+        sdl2.SDL_RenderClear(renderer)
+        try:
+            compose()
+        finally:
+            sdl2.SDL_SetRenderTarget(renderer, None)
+            sdl2.SDL_SetRenderDrawColor(renderer, *[x.value for x in color])
+        self.dst = sdl2.SDL_Rect(0, 0,
+            int(w.value / sx.value), int(h.value / sy.value))
+        return True
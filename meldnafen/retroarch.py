@@ -1,23 +1,68 @@
-import re
-from tempfile import NamedTemporaryFile
+import hashlib
+import logging
+import os
+import time
+
+from meldnafen.storage import atomic_write, cache_dir
+
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 32
+MAX_AGE = 30 * 24 * 3600
+GLOBAL_CONTROLS = ("enable_hotkey", "menu_toggle")
 
 
 def prepare(command, controls, settings):
-    with NamedTemporaryFile('wt', prefix='retroarch-', delete=False) as fh:
-        for player, player_controls in sorted(controls.items()):
-            write_retroarch_controls(fh, player, player_controls)
-            fh.write("\n")
-        fh.write("input_autodetect_enable = false\n")
-        fh.write("video_force_aspect = true\n")
-        fh.write("video_scale_integer = true\n")
-        fh.write("video_smooth = {}\n".format(
-            "true" if settings['smooth'] else "false"))
-        return command + ['--appendconfig', fh.name]
-
-
-def write_retroarch_controls(fileobj, player, controls):
-    for k, v in controls.items():
-        if player == "1" and re.search(r"^(enable_hotkey|menu_toggle)", k):
-            fileobj.write("input_{} = {}\n".format(k, v))
+    content = generate_config(controls, settings)
+    directory = cache_dir(settings, 'retroarch')
+    path = os.path.join(directory, "%s.cfg"
+        % hashlib.sha1(content.encode('utf-8')).hexdigest())
+    try:
+        # NOTE: refresh the mtime used for pruning
+        os.utime(path)
+    except OSError:
+        atomic_write(path, content)
+        prune(directory)
+    return command + ['--appendconfig', path]
+
+
+def generate_config(controls, settings):
+    lines = []
+    for player, player_controls in sorted(controls.items()):
+        lines.extend(retroarch_controls(player, player_controls))
+        lines.append("")
+    lines.extend([
+        "input_autodetect_enable = false",
+        "video_force_aspect = true",
+        "video_scale_integer = true",
+        "video_smooth = {}".format(
+            "true" if settings['smooth'] else "false"),
+    ])
+    return "\n".join(lines) + "\n"
+
+
+def retroarch_controls(player, controls):
+    for k, v in sorted(controls.items()):
+        if player == "1" and k.startswith(GLOBAL_CONTROLS):
+            yield "input_{} = {}".format(k, v)
         else:
-            fileobj.write("input_player{}_{} = {}\n".format(player, k, v))
+            yield "input_player{}_{} = {}".format(player, k, v)
+
+
+def prune(directory):
+    entries = []
+    for entry in os.scandir(directory):
+        try:
+            entries.append((entry.stat().st_mtime, entry.path))
+        except OSError:
+            continue
+    entries.sort(reverse=True)
+    limit = time.time() - MAX_AGE
+    for i, (mtime, path) in enumerate(entries):
+        if i >= MAX_ENTRIES or mtime < limit:
+            logger.debug("Removing stale configuration %s", path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
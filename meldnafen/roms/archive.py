@@ -0,0 +1,82 @@
+import logging
+import os
+import re
+import zipfile
+
+
+ARCHIVE_REGEX = re.compile(r".*\.(zip|7z)$", re.IGNORECASE)
+# NOTE: the syntax used by RetroArch to load a file from an archive
+MEMBER_REGEX = re.compile(r"^(.*?\.(?:zip|7z))#(.+)$", re.IGNORECASE)
+
+logger = logging.getLogger(__name__)
+
+# NOTE: py7zr loads a large set of compression modules, it is imported when
+#       the first 7z archive is found
+_py7zr = None
+
+
+def load_py7zr():
+    """
+    Return the py7zr module or None if it is not installed.
+    """
+    global _py7zr
+    if _py7zr is None:
+        try:
+            import py7zr
+        except ImportError:
+            py7zr = False
+        _py7zr = py7zr
+    return _py7zr or None
+
+
+def is_archive(name):
+    if not ARCHIVE_REGEX.match(name):
+        return False
+    return not name.lower().endswith(".7z") or load_py7zr() is not None
+
+
+def source_file(name):
+    """
+    Return the file of a rom on the disk: the archive for a rom inside an
+    archive.
+    """
+    match = MEMBER_REGEX.match(name)
+    return match.group(1) if match else name
+
+
+def list_archive(path, accept):
+    """
+    Return [name, size] for every file of an archive accepted by the rules.
+    Only the central directory of the archive is read.
+    """
+    if path.lower().endswith(".7z"):
+        with load_py7zr().SevenZipFile(path, 'r') as archive:
+            members = [
+                (x.filename, x.uncompressed)
+                for x in archive.list() if not x.is_directory
+            ]
+    else:
+        with zipfile.ZipFile(path) as archive:
+            members = [
+                (x.filename, x.file_size)
+                for x in archive.infolist() if not x.is_dir()
+            ]
+    return sorted(
+        [name, size] for name, size in members
+        if accept(os.path.basename(name)))
+
+
+def open_member(path):
+    """
+    Open a rom inside an archive for reading, decompressing it.
+    """
+    filepath, member = MEMBER_REGEX.match(path).groups()
+    if filepath.lower().endswith(".7z"):
+        with load_py7zr().SevenZipFile(filepath, 'r') as archive:
+            return archive.read([member])[member]
+    archive = zipfile.ZipFile(filepath)
+    try:
+        return archive.open(member)
+    finally:
+        # NOTE: the member keeps its own reference to the file
+        archive.close()
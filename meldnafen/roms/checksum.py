@@ -0,0 +1,168 @@
+from functools import partial
+import hashlib
+import logging
+import multiprocessing
+import os
+import sqlite3
+import threading
+import xml.etree.ElementTree as ElementTree
+import zlib
+
+from meldnafen.roms.archive import MEMBER_REGEX, open_member
+from meldnafen.roms.database import RomDatabase
+
+
+BLOCK_SIZE = 1 << 20
+# NOTE: the checksums are written by batches so an interrupted run resumes
+#       where it stopped
+BATCH_SIZE = 64
+POLL_TIMEOUT = 1
+
+logger = logging.getLogger(__name__)
+
+
+def checksum_file(entry):
+    root, path = entry
+    crc32 = 0
+    sha1 = hashlib.sha1()
+    filepath = os.path.join(root, path)
+    try:
+        if MEMBER_REGEX.match(path):
+            # NOTE: the rom is hashed, not the archive
+            st = os.stat(MEMBER_REGEX.match(filepath).group(1))
+            fh = open_member(filepath)
+        else:
+            fh = open(filepath, 'rb')
+            st = os.fstat(fh.fileno())
+        with fh:
+            for block in iter(partial(fh.read, BLOCK_SIZE), b""):
+                crc32 = zlib.crc32(block, crc32)
+                sha1.update(block)
+    except Exception as exc:
+        # NOTE: broken archives raise all kinds of errors
+        return root, path, None, str(exc)
+    return root, path, (
+        st.st_size, st.st_mtime_ns, "%08x" % crc32, sha1.hexdigest()), None
+
+
+def lower_priority():
+    # NOTE: the UI process keeps its priority
+    try:
+        os.nice(19)
+    except OSError:
+        pass
+
+
+def load_dat(path, stopped=None):
+    """
+    Load a No-Intro or Logiqx XML DAT file and return the name of the games
+    by SHA-1 and by (CRC32, size). Return None if the stopped event is set
+    meanwhile.
+    """
+    by_sha1, by_crc32 = {}, {}
+    for _, element in ElementTree.iterparse(os.path.expanduser(path)):
+        if element.tag not in ('game', 'machine'):
+            continue
+        # NOTE: parsing a whole DAT file takes a few seconds
+        if stopped is not None and stopped.is_set():
+            return None
+        name = element.get('name')
+        for rom in element.iter('rom'):
+            if rom.get('sha1'):
+                by_sha1[rom.get('sha1').lower()] = name
+            if rom.get('crc') and rom.get('size'):
+                by_crc32[(rom.get('crc').lower(), int(rom.get('size')))] = \
+                    name
+        element.clear()
+    return by_sha1, by_crc32
+
+
+class ChecksumWorker(threading.Thread):
+    """
+    Compute the missing checksums of the rom database in a pool of
+    processes, then match the titles with the DAT files.
+    """
+
+    def __init__(self, database, dats=None, processes=None):
+        threading.Thread.__init__(self, name="rom-checksum")
+        self.daemon = True
+        self.database = database
+        self.dats = dats or {}
+        self.processes = processes or os.cpu_count()
+        self.stopped = threading.Event()
+        self.attempted = set()
+        self.count = 0
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        try:
+            with RomDatabase(self.database) as database:
+                # NOTE: the roms found by the scans running meanwhile are
+                #       picked up by the next round
+                while not self.stopped.is_set() and self.compute(database):
+                    pass
+                for console, dat in sorted(self.dats.items()):
+                    if self.stopped.is_set():
+                        return
+                    self.match_titles(database, console, dat)
+        except (sqlite3.Error, OSError) as exc:
+            logger.warning("Could not update the rom checksums: %s", exc)
+
+    def compute(self, database):
+        missing = [
+            x for x in database.missing_checksums()
+            if x not in self.attempted
+        ]
+        if not missing:
+            return 0
+        self.attempted.update(missing)
+        logger.debug("Computing the checksum of %d roms", len(missing))
+        # NOTE: forking a process that runs SDL is not safe
+        context = multiprocessing.get_context('spawn')
+        pool = context.Pool(self.processes, initializer=lower_priority)
+        try:
+            # NOTE: with chunks the result is a generator without timeout
+            results = pool.imap_unordered(checksum_file, missing)
+            batch = []
+            while not self.stopped.is_set():
+                try:
+                    root, path, checksums, error = results.next(POLL_TIMEOUT)
+                except multiprocessing.TimeoutError:
+                    continue
+                except StopIteration:
+                    break
+                if error:
+                    logger.warning("Could not read %s: %s", path, error)
+                    continue
+                batch.append((root, path) + checksums)
+                if len(batch) >= BATCH_SIZE:
+                    self.count += database.set_checksums(batch)
+                    batch = []
+            self.count += database.set_checksums(batch)
+        finally:
+            pool.terminate()
+            pool.join()
+        logger.debug("%d checksums computed", self.count)
+        return len(missing)
+
+    def match_titles(self, database, console, dat):
+        try:
+            dat_titles = load_dat(dat, self.stopped)
+        except (OSError, ElementTree.ParseError) as exc:
+            logger.warning("Could not load DAT file %s: %s", dat, exc)
+            return
+        if dat_titles is None:
+            return
+        by_sha1, by_crc32 = dat_titles
+        titles = []
+        for root, path, size, crc32, sha1 in database.checksums(console):
+            if self.stopped.is_set():
+                return
+            title = by_sha1.get(sha1) or by_crc32.get((crc32, size))
+            if title:
+                titles.append((title, root, path))
+        database.set_titles(titles)
+        logger.debug("%s: %d titles matched with %s", console, len(titles),
+            dat)
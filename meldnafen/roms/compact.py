@@ -0,0 +1,140 @@
+from array import array
+import sys
+
+
+class CompactList(object):
+    """
+    Read-only list of strings stored as a single UTF-8 blob and an array of
+    offsets, it uses a fraction of the memory of a list of str.
+
+    The UTF-8 byte order is the code point order: a sorted list of str
+    gives a sorted blob and the bisect module can be used directly.
+    """
+
+    def __init__(self, items=()):
+        blob = bytearray()
+        offsets = array('I', [0])
+        for item in items:
+            blob += item.encode('utf-8', 'surrogateescape')
+            offsets.append(len(blob))
+        self.blob = bytes(blob)
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def get(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].decode(
+            'utf-8', 'surrogateescape')
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # NOTE: a page is a plain list
+            return [self.get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("CompactList index out of range")
+        return self.get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def __repr__(self):
+        return "<CompactList of %d items, %d bytes>" % (len(self), self.nbytes)
+
+    @property
+    def nbytes(self):
+        return (sys.getsizeof(self.blob) +
+            self.offsets.itemsize * len(self.offsets))
+
+
+class MergedList(object):
+    """
+    Read-only view of several sorted lists merged together. An item is
+    stored as the index of its list and its position in that list, the
+    strings are not copied.
+    """
+
+    def __init__(self, sources, origins, positions):
+        self.sources = sources
+        self.origins = origins
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.origins)
+
+    def get(self, index):
+        return self.sources[self.origins[index]][self.positions[index]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("MergedList index out of range")
+        return self.get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def __repr__(self):
+        return "<MergedList of %d items from %d lists>" % (
+            len(self), len(self.sources))
+
+    @property
+    def nbytes(self):
+        return (sum(memory_usage(x) for x in self.sources) +
+            self.origins.itemsize * len(self.origins) +
+            self.positions.itemsize * len(self.positions))
+
+
+class FilteredList(object):
+    """
+    Read-only view of some items of a list, stored as their sorted
+    positions in that list. The items are decoded when they are read.
+    """
+
+    def __init__(self, items, positions):
+        self.items = items
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.positions)
+
+    def get(self, index):
+        return self.items[self.positions[index]]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("FilteredList index out of range")
+        return self.get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.get(i)
+
+    def __repr__(self):
+        return "<FilteredList of %d items out of %d>" % (
+            len(self), len(self.items))
+
+    @property
+    def nbytes(self):
+        # NOTE: the items belong to the list that is filtered
+        return self.positions.itemsize * len(self.positions)
+
+
+def memory_usage(roms):
+    """
+    Return the number of bytes used by a list of roms.
+    """
+    if isinstance(roms, (CompactList, MergedList, FilteredList)):
+        return roms.nbytes
+    return sys.getsizeof(roms) + sum(sys.getsizeof(x) for x in roms)
@@ -0,0 +1,253 @@
+import logging
+import os
+import re
+import sqlite3
+import time
+
+from meldnafen.roms.archive import source_file
+
+
+SCHEMA_VERSION = 1
+
+SCHEMA = [
+    """
+    CREATE TABLE roms (
+        root TEXT NOT NULL,
+        path TEXT NOT NULL,
+        console TEXT NOT NULL,
+        size INTEGER,
+        mtime INTEGER,
+        crc32 TEXT,
+        sha1 TEXT,
+        title TEXT NOT NULL,
+        play_count INTEGER NOT NULL DEFAULT 0,
+        last_played REAL,
+        PRIMARY KEY (root, path)
+    )
+    """,
+    "CREATE INDEX roms_console ON roms (console)",
+    "CREATE INDEX roms_sha1 ON roms (sha1)",
+    "CREATE INDEX roms_recent ON roms (console, last_played)",
+    "CREATE INDEX roms_played ON roms (console, play_count)",
+]
+
+# NOTE: statements upgrading a database from the version of their key to
+#       the next one, the play statistics must survive them: a table that
+#       changes is created under a new name, filled from the old one and
+#       renamed
+MIGRATIONS = {}
+
+TAGS_REGEX = re.compile(r"(\s*[\(\[][^\)\]]*[\)\]])+$")
+
+logger = logging.getLogger(__name__)
+
+# NOTE: lists already written to the database, the rom index returns the
+#       same list as long as the directory did not change
+synced = {}
+
+
+def display_title(path):
+    """
+    Return the title of a rom: the file name without its extension and
+    without the tags at the end like "(USA)" or "[!]".
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    return TAGS_REGEX.sub("", name) or name
+
+
+def escape_like(value):
+    return re.sub(r"([\\%_])", r"\\\1", value)
+
+
+class RomDatabase(object):
+    """
+    Catalog of the roms of every console with their metadata and play
+    statistics, stored in a SQLite database. It is written from the scans
+    and read for the checksums, the titles, the duplicates and the games
+    played, the UI keeps its own compact list of the roms.
+    """
+
+    def __init__(self, filename):
+        self.filename = os.path.expanduser(filename)
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        # NOTE: the scanner threads and the UI write to the database
+        self.connection = sqlite3.connect(self.filename, timeout=5)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        try:
+            if self.version() != SCHEMA_VERSION:
+                self.upgrade()
+        except sqlite3.Error:
+            self.connection.close()
+            raise
+
+    def version(self):
+        return self.connection.execute("PRAGMA user_version").fetchone()[0]
+
+    def upgrade(self):
+        # NOTE: the scanner threads may open the database at the same time,
+        #       the version is read again once the database is locked
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            version = self.version()
+            if version > SCHEMA_VERSION:
+                raise sqlite3.DatabaseError(
+                    "schema version %d is not supported" % version)
+            if version == 0:
+                statements = SCHEMA
+            else:
+                statements = [
+                    x for v in range(version, SCHEMA_VERSION)
+                    for x in MIGRATIONS[v]
+                ]
+            for statement in statements:
+                self.connection.execute(statement)
+            self.connection.execute(
+                "PRAGMA user_version = %d" % SCHEMA_VERSION)
+        except BaseException:
+            self.connection.rollback()
+            raise
+        self.connection.commit()
+        if version:
+            logger.info("Rom database upgraded from version %d to %d",
+                version, SCHEMA_VERSION)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def insert(self, console, root, paths):
+        rows = []
+        for path in paths:
+            # NOTE: the size and the mtime of a rom inside an archive are the
+            #       ones of the archive
+            try:
+                st = os.stat(os.path.join(root, source_file(path)))
+            except OSError:
+                continue
+            rows.append((root, path, console, st.st_size, st.st_mtime_ns,
+                display_title(path)))
+        # NOTE: a rom written again keeps its statistics, its checksums are
+        #       only kept if it did not change
+        self.connection.executemany(
+            "INSERT INTO roms (root, path, console, size, mtime, title) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (root, path) DO UPDATE SET "
+            "crc32 = CASE WHEN size = excluded.size "
+            "AND mtime = excluded.mtime THEN crc32 END, "
+            "sha1 = CASE WHEN size = excluded.size "
+            "AND mtime = excluded.mtime THEN sha1 END, "
+            "console = excluded.console, size = excluded.size, "
+            "mtime = excluded.mtime", rows)
+        return len(rows)
+
+    def sync(self, console, root, roms):
+        """
+        Make the catalog of a rom directory match the list of its roms.
+        Only the roms added or removed since the last time are stat'ed and
+        written.
+        """
+        existing = set(x for x, in self.connection.execute(
+            "SELECT path FROM roms WHERE root = ?", (root,)))
+        current = set(roms)
+        removed = existing - current
+        with self.connection:
+            added = self.insert(console, root, current - existing)
+            self.connection.executemany(
+                "DELETE FROM roms WHERE root = ? AND path = ?",
+                ((root, x) for x in removed))
+        return added, len(removed)
+
+    def update(self, console, root, added, removed, removed_dirs=()):
+        with self.connection:
+            self.insert(console, root, added)
+            self.connection.executemany(
+                "DELETE FROM roms WHERE root = ? AND path = ?",
+                ((root, x) for x in removed))
+            self.connection.executemany(
+                "DELETE FROM roms WHERE root = ? AND path LIKE ? ESCAPE '\\'",
+                ((root, escape_like(x + os.sep) + "%") for x in removed_dirs))
+
+    def record_play(self, root, path):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE roms SET play_count = play_count + 1, "
+                "last_played = ? WHERE root = ? AND path = ?",
+                (time.time(), root, path))
+
+    def recently_played(self, console, limit):
+        return self.connection.execute(
+            "SELECT root, path FROM roms WHERE console = ? "
+            "AND last_played IS NOT NULL ORDER BY last_played DESC LIMIT ?",
+            (console, limit)).fetchall()
+
+    def most_played(self, console, limit):
+        return self.connection.execute(
+            "SELECT root, path FROM roms WHERE console = ? "
+            "AND play_count > 0 ORDER BY play_count DESC, last_played DESC "
+            "LIMIT ?", (console, limit)).fetchall()
+
+    def missing_checksums(self):
+        return self.connection.execute(
+            "SELECT root, path FROM roms WHERE sha1 IS NULL "
+            "ORDER BY root, path").fetchall()
+
+    def set_checksums(self, checksums):
+        """
+        Store (root, path, size, mtime, crc32, sha1) rows. A checksum is
+        ignored if the rom changed since it was added.
+        """
+        with self.connection:
+            cursor = self.connection.executemany(
+                "UPDATE roms SET crc32 = ?, sha1 = ? WHERE root = ? "
+                "AND path = ? AND size = ? AND mtime = ?",
+                ((crc32, sha1, root, path, size, mtime)
+                    for root, path, size, mtime, crc32, sha1 in checksums))
+        return cursor.rowcount
+
+    def checksums(self, console):
+        return self.connection.execute(
+            "SELECT root, path, size, crc32, sha1 FROM roms "
+            "WHERE console = ? AND sha1 IS NOT NULL", (console,)).fetchall()
+
+    def set_titles(self, titles):
+        with self.connection:
+            self.connection.executemany(
+                "UPDATE roms SET title = ? WHERE root = ? AND path = ?",
+                titles)
+
+    def duplicates(self):
+        """
+        Return (sha1, console, root, path) for the roms found more than
+        once in any of the rom directories, grouped by checksum.
+        """
+        return self.connection.execute(
+            "SELECT sha1, console, root, path FROM roms WHERE sha1 IN ("
+            "SELECT sha1 FROM roms WHERE sha1 IS NOT NULL "
+            "GROUP BY sha1 HAVING COUNT(*) > 1) "
+            "ORDER BY sha1, root, path").fetchall()
+
+
+def sync_database(filename, console, root, roms):
+    """
+    Write the result of a scan to the database, called by the scanner
+    threads.
+    """
+    key = (os.path.expanduser(filename), root)
+    if synced.get(key) is roms:
+        return
+    try:
+        with RomDatabase(filename) as database:
+            added, removed = database.sync(console, root, roms)
+    except (sqlite3.Error, OSError) as exc:
+        logger.warning("Could not update the rom database: %s", exc)
+        return
+    synced[key] = roms
+    if added or removed:
+        logger.debug("%s: %d roms added to the database, %d removed",
+            root, added, removed)
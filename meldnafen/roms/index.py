@@ -0,0 +1,215 @@
+from array import array
+import hashlib
+from heapq import merge
+from itertools import count, repeat
+import logging
+import os
+
+from meldnafen.roms.archive import is_archive, list_archive, source_file
+from meldnafen.roms.compact import CompactList, MergedList
+from meldnafen.roms.scanner import compile_rules, scan_dir, stamp, walk
+from meldnafen.storage import load_json, save_json
+
+
+INDEX_VERSION = 4
+
+loaded_indexes = {}
+
+
+def rom_paths(path):
+    """
+    Return the rom directories of a console, the path of an emulator can be
+    a single directory or a list.
+    """
+    if isinstance(path, str):
+        return [path]
+    return list(path)
+
+
+def merge_roms(sources):
+    """
+    Merge the sorted lists of roms of several directories in a MergedList
+    that refers to the lists. A rom found in more than one directory is
+    taken from the first one.
+    """
+    if len(sources) == 1:
+        return sources[0]
+    origins, positions = array('H'), array('I')
+    last = None
+    # NOTE: the ties are sorted by the index of the directory
+    for rom, origin, position in merge(*(
+            zip(roms, repeat(i), count()) for i, roms in enumerate(sources))):
+        if rom == last:
+            continue
+        last = rom
+        origins.append(origin)
+        positions.append(position)
+    return MergedList(sources, origins, positions)
+
+
+class RomIndex(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, include=None, exclude=None, cache=None,
+            archives=False):
+        self.path = os.path.expanduser(path)
+        self.include = include or ""
+        self.exclude = exclude or ""
+        self.archives = archives
+        self.accept = compile_rules(self.include, self.exclude)
+        key = "\0".join([self.path, self.include, self.exclude] +
+            (["archives"] if archives else []))
+        self.filename = os.path.join(cache, "roms-%s.json"
+            % hashlib.sha1(key.encode('utf-8')).hexdigest())
+        self.dirs = {}
+        # NOTE: [size, mtime, [[name, size], ...]] of every archive
+        self.contents = {}
+
+    def load(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return None
+        # NOTE: the index parsed by a previous scan is still in memory
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self.filename in loaded_indexes:
+            loaded_stamp, index = loaded_indexes[self.filename]
+            if loaded_stamp == stamp:
+                return index
+        index = load_json(self.filename)
+        if not index or index.get('version') != INDEX_VERSION:
+            return None
+        # NOTE: the list stays in memory for as long as the app runs
+        index['roms'] = CompactList(index['roms'])
+        loaded_indexes[self.filename] = (stamp, index)
+        return index
+
+    def save(self, dirs, roms, contents):
+        self.dirs = dirs
+        self.contents = contents
+        try:
+            save_json(self.filename, {
+                'version': INDEX_VERSION,
+                'dirs': dirs,
+                'roms': roms,
+                'archives': contents,
+            })
+        except OSError as exc:
+            self.logger.warning("Could not save rom index %s: %s",
+                self.filename, exc)
+
+    def scan(self, rebuild=False, progress=None):
+        index = None if rebuild else self.load()
+        if index is None:
+            self.logger.debug("Building rom index: %s", self.path)
+            dirs, contents = {}, {}
+            roms = []
+            for name in self.expand(
+                    walk(self.path, self.accept, dirs), contents, {}):
+                roms.append(name)
+                if progress:
+                    progress(name)
+            roms.sort()
+            self.save(dirs, roms, contents)
+            return CompactList(roms)
+        changed, removed = [], set()
+        for relpath, old_stamp in index['dirs'].items():
+            try:
+                if stamp(os.path.join(self.path, relpath)) != old_stamp:
+                    changed.append(relpath)
+            except OSError:
+                if not relpath:
+                    raise
+                removed.add(relpath)
+        if not (changed or removed):
+            self.logger.debug("Rom index up to date: %s", self.path)
+            self.dirs = index['dirs']
+            self.contents = index['archives']
+            return index['roms']
+        self.logger.debug("Updating rom index: %s (%d directories changed)",
+            self.path, len(changed) + len(removed))
+        dirs, roms, contents = self.update(index, changed, removed)
+        self.save(dirs, roms, contents)
+        return CompactList(roms)
+
+    def update(self, index, changed, removed):
+        dirs = dict(index['dirs'])
+        added = []
+        for relpath in changed:
+            # NOTE: stat before listing so a change made during the scan
+            #       invalidates the index on the next run
+            dirs[relpath] = stamp(os.path.join(self.path, relpath))
+            files, subdirs = scan_dir(self.path, relpath, self.accept)
+            added.extend(files)
+            for subdir in subdirs:
+                if subdir in dirs:
+                    continue
+                try:
+                    added.extend(walk(self.path, self.accept, dirs, subdir))
+                except OSError as exc:
+                    self.logger.warning("Could not scan directory %s: %s",
+                        subdir, exc)
+            subdirs = set(subdirs)
+            removed.update(
+                x for x in index['dirs']
+                if x and x not in subdirs and os.path.dirname(x) == relpath)
+        for relpath in list(dirs):
+            if any(relpath == x or relpath.startswith(x + os.sep)
+                    for x in removed):
+                dirs.pop(relpath)
+                removed.add(relpath)
+        stale = removed.union(changed)
+        contents = {
+            k: v for k, v in index['archives'].items()
+            if os.path.dirname(k) not in stale
+        }
+        added = list(self.expand(added, contents, index['archives']))
+        roms = list(merge(
+            (x for x in index['roms']
+                if os.path.dirname(source_file(x)) not in stale),
+            sorted(added)))
+        return dirs, roms, contents
+
+    def read_archive(self, name, cached):
+        path = os.path.join(self.path, name)
+        try:
+            st = os.stat(path)
+            entry = cached.get(name)
+            if entry and entry[:2] == [st.st_size, st.st_mtime_ns]:
+                return entry
+            return [st.st_size, st.st_mtime_ns,
+                list_archive(path, self.accept)]
+        except Exception as exc:
+            # NOTE: a broken archive is listed as a file
+            self.logger.warning("Could not read archive %s: %s", path, exc)
+            return None
+
+    def expand(self, names, contents, cached):
+        """
+        Replace the archives by the roms they contain. Only the archives
+        that changed since they were cached are read.
+        """
+        for name in names:
+            if not (self.archives and is_archive(name)):
+                yield name
+                continue
+            entry = self.read_archive(name, cached)
+            if entry is None:
+                yield name
+                continue
+            contents[name] = entry
+            for member, _ in entry[2]:
+                yield "%s#%s" % (name, member)
+
+    def members(self, name):
+        """
+        Return the roms of an archive as they are listed.
+        """
+        if name not in self.contents:
+            return []
+        return ["%s#%s" % (name, x) for x, _ in self.contents[name][2]]
+
+    def expand_added(self, names):
+        # NOTE: used for the files reported by the watcher, the index is
+        #       updated on disk by the next scan
+        return list(self.expand(names, self.contents, self.contents))
@@ -0,0 +1,99 @@
+from itertools import count
+import logging
+import queue
+import threading
+
+
+PRIORITY_FOREGROUND = 0
+PRIORITY_BACKGROUND = 1
+
+
+class ScanJob(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, index, on_done=None):
+        self.index = index
+        self.on_done = on_done
+        self.lock = threading.Lock()
+        self.started = False
+        # NOTE: set when a list displays the progress of the scan
+        self.foreground = False
+        self.done = False
+        # NOTE: appended by the worker and read by the UI thread without
+        #       locking, list.append is atomic
+        self.found = []
+        self.roms = None
+        self.error = None
+
+    def run(self):
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+        try:
+            self.roms = self.index.scan(progress=self.found.append)
+        except Exception as exc:
+            self.logger.error("Could not scan %s: %s", self.index.path, exc)
+            self.error = exc
+            self.roms = []
+        self.done = True
+        # NOTE: the names found are only used to show the progress, the list
+        #       displaying it resets them once it read the result. Read
+        #       after setting done, see ScanPool.submit
+        if not self.foreground:
+            self.found = []
+        if self.on_done and not self.error:
+            # NOTE: still in the worker thread
+            self.on_done(self.roms)
+
+
+class ScanPool(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, workers=4):
+        self.queue = queue.PriorityQueue()
+        self.jobs = {}
+        self.order = count()
+        for i in range(workers):
+            thread = threading.Thread(
+                target=self.work, name="rom-scanner-%d" % i)
+            thread.daemon = True
+            thread.start()
+
+    def work(self):
+        while True:
+            _, _, job = self.queue.get()
+            job.run()
+
+    def submit(self, index, priority=PRIORITY_BACKGROUND, on_done=None):
+        job = self.jobs.get(index.filename)
+        if job is not None and priority == PRIORITY_FOREGROUND:
+            # NOTE: set before checking if the job is done, the worker
+            #       checks it after, one of them sees the other
+            job.foreground = True
+        # NOTE: a finished job may be outdated, scanning again through the
+        #       index only costs a stat per directory
+        if job is None or job.done:
+            job = self.jobs[index.filename] = ScanJob(index, on_done)
+            job.foreground = priority == PRIORITY_FOREGROUND
+        elif job.started or priority == PRIORITY_BACKGROUND:
+            return job
+        # NOTE: a job can be queued twice when it gets prioritized, the
+        #       first worker to pick it up runs it and the other skips it
+        self.queue.put((priority, next(self.order), job))
+        return job
+
+    def release(self, job):
+        if self.jobs.get(job.index.filename) is job:
+            self.jobs.pop(job.index.filename)
+
+
+_shared_pool = None
+
+
+def shared_pool(workers):
+    # NOTE: shared by the apps run in the same process
+    global _shared_pool
+    if _shared_pool is None:
+        _shared_pool = ScanPool(workers)
+    return _shared_pool
@@ -0,0 +1,112 @@
+import fnmatch
+import logging
+import os
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+def split_patterns(patterns):
+    """
+    Return the patterns of the files and the patterns of the directories,
+    the latter end with a slash.
+    """
+    files, dirs = [], []
+    for pattern in (patterns.split(';') if patterns else []):
+        if pattern.endswith('/'):
+            dirs.append(pattern.rstrip('/'))
+        elif pattern:
+            files.append(pattern)
+    return files, dirs
+
+
+def compile_matcher(include, exclude):
+    include = "|".join(fnmatch.translate(x) for x in include if x)
+    exclude = "|".join(fnmatch.translate(x) for x in exclude if x)
+    if not exclude:
+        return lambda name: True
+    # NOTE: a name is accepted if it is not excluded or if it is explicitly
+    #       included, both checks are done by a single zero-width match
+    if include:
+        regex = r"(?=%s)|(?!%s)" % (include, exclude)
+    else:
+        regex = r"(?!%s)" % exclude
+    return re.compile(regex).match
+
+
+class Rules(object):
+    """
+    Include and exclude rules of a console. Called with a name, it tells if
+    a file is accepted; the patterns ending with a slash are the rules of
+    the directories, every directory is entered otherwise.
+    """
+
+    def __init__(self, include=None, exclude=None):
+        include_files, include_dirs = split_patterns(include)
+        exclude_files, exclude_dirs = split_patterns(exclude)
+        self.accept_file = compile_matcher(include_files, exclude_files)
+        self.directory = compile_matcher(include_dirs, exclude_dirs)
+
+    def __call__(self, name):
+        return self.accept_file(name)
+
+
+def compile_rules(include=None, exclude=None):
+    return Rules(include, exclude)
+
+
+def stamp(path):
+    st = os.stat(path)
+    return [st.st_ino, st.st_mtime_ns]
+
+
+def walk(root, accept, dirs=None, top=""):
+    stack = [top]
+    seen = set()
+    while stack:
+        relpath = stack.pop()
+        path = os.path.join(root, relpath)
+        try:
+            st = os.stat(path)
+            entries = os.scandir(path)
+        except OSError as exc:
+            if relpath == top:
+                raise
+            logger.warning("Could not scan directory %s: %s", path, exc)
+            continue
+        with entries:
+            # NOTE: symlinked directories may point back to a parent
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            if dirs is not None:
+                dirs[relpath] = [st.st_ino, st.st_mtime_ns]
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                name = os.path.join(relpath, entry.name)
+                if is_dir:
+                    if accept.directory(entry.name):
+                        stack.append(name)
+                elif accept(entry.name):
+                    yield name
+
+
+def scan_dir(root, relpath, accept):
+    files, subdirs = [], []
+    with os.scandir(os.path.join(root, relpath)) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            name = os.path.join(relpath, entry.name)
+            if is_dir:
+                if accept.directory(entry.name):
+                    subdirs.append(name)
+            elif accept(entry.name):
+                files.append(name)
+    return files, subdirs
@@ -0,0 +1,134 @@
+from array import array
+from bisect import bisect_left
+import os
+import re
+import threading
+
+from meldnafen.roms.compact import CompactList, FilteredList
+
+
+TOKEN_REGEX = re.compile(r"[^\W_]+")
+
+# NOTE: sorts after any string starting with the same prefix
+PREFIX_END = "\U0010ffff"
+
+CACHE_SIZE = 64
+
+# NOTE: shorter words only match the start of the tokens, they are found
+#       inside too many of them
+MIN_SUBSTRING = 3
+
+
+class SearchIndex(object):
+    """
+    Case insensitive search in a sorted list of roms. A rom matches when
+    every word of the query is found in one of the tokens of its name, or
+    when the query starts its path. The words shorter than MIN_SUBSTRING
+    must start the token.
+
+    The substrings are found with a sorted list of the suffixes of the
+    distinct tokens, its size depends on the vocabulary and not on the
+    number of roms.
+    """
+
+    def __init__(self, roms):
+        self.roms = roms
+        postings = {}
+        keys = []
+        for index, rom in enumerate(roms):
+            key = rom.lower()
+            keys.append(key)
+            # NOTE: the extension would match most of the queries
+            name = os.path.splitext(key)[0]
+            for token in set(TOKEN_REGEX.findall(name)):
+                if token not in postings:
+                    postings[token] = array('I')
+                postings[token].append(index)
+        # NOTE: the tokens starting with a word are a contiguous range of
+        #       the sorted tokens
+        self.tokens = sorted(postings)
+        self.postings = [postings[x] for x in self.tokens]
+        suffixes = sorted(
+            (token[i:], n)
+            for n, token in enumerate(self.tokens)
+            for i in range(1, len(token) - MIN_SUBSTRING + 1))
+        self.suffixes = CompactList(x for x, _ in suffixes)
+        self.suffix_tokens = array('I', (n for _, n in suffixes))
+        self.order = array('I',
+            sorted(range(len(keys)), key=keys.__getitem__))
+        # NOTE: the sort keys are precomputed, bisect decodes only the keys
+        #       it compares
+        self.keys = CompactList(keys[x] for x in self.order)
+        self.cache = {}
+
+    def prefix_range(self, keys, prefix):
+        return (bisect_left(keys, prefix),
+            bisect_left(keys, prefix + PREFIX_END))
+
+    def match_word(self, word):
+        start, end = self.prefix_range(self.tokens, word)
+        tokens = range(start, end)
+        if len(word) >= MIN_SUBSTRING:
+            start, end = self.prefix_range(self.suffixes, word)
+            tokens = set(tokens).union(self.suffix_tokens[start:end])
+        if len(tokens) == 1:
+            # NOTE: already sorted, no need to build a set
+            return self.postings[next(iter(tokens))]
+        matches = set()
+        for token in tokens:
+            matches.update(self.postings[token])
+        return matches
+
+    def match_prefix(self, query):
+        start, end = self.prefix_range(self.keys, query)
+        return self.order[start:end]
+
+    def search(self, query):
+        query = query.lower()
+        if query in self.cache:
+            return self.cache[query]
+        words = TOKEN_REGEX.findall(query)
+        if not words:
+            return self.roms
+        # NOTE: start with the smallest set of matches
+        found = sorted((self.match_word(x) for x in set(words)), key=len)
+        matches = found[0]
+        if len(found) > 1:
+            matches = set(matches)
+            for other in found[1:]:
+                if not matches:
+                    break
+                matches.intersection_update(other)
+        # NOTE: the words of a query with punctuation may not be tokens,
+        #       it may still be the start of a name
+        if TOKEN_REGEX.sub("", query).strip():
+            matches = set(matches)
+            matches.update(self.match_prefix(query))
+        if len(matches) == len(self.roms):
+            result = self.roms
+        elif isinstance(matches, set):
+            # NOTE: the indexes keep the order of the list, the roms are
+            #       only decoded when the page displays them
+            result = FilteredList(self.roms, array('I', sorted(matches)))
+        else:
+            result = FilteredList(self.roms, matches)
+        if len(self.cache) >= CACHE_SIZE:
+            self.cache.clear()
+        self.cache[query] = result
+        return result
+
+
+class SearchIndexBuilder(threading.Thread):
+    """
+    Build the search index of a list in the background.
+    """
+
+    def __init__(self, roms):
+        threading.Thread.__init__(self, name="search-index")
+        self.daemon = True
+        self.roms = roms
+        self.index = None
+        self.start()
+
+    def run(self):
+        self.index = SearchIndex(self.roms)
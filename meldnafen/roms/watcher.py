@@ -0,0 +1,175 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import time
+
+from meldnafen.roms.scanner import walk
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+    IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR)
+
+EVENT = struct.Struct("iIII")
+
+
+class Inotify(object):
+    libc = None
+
+    def __init__(self):
+        if Inotify.libc is None:
+            Inotify.libc = ctypes.CDLL(
+                ctypes.util.find_library('c') or "libc.so.6", use_errno=True)
+        self.fd = self.check(self.libc.inotify_init1(
+            os.O_NONBLOCK | os.O_CLOEXEC))
+
+    def check(self, result):
+        if result < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        return result
+
+    def add_watch(self, path, mask):
+        return self.check(self.libc.inotify_add_watch(
+            self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        # NOTE: fails if the kernel already removed the watch
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        while True:
+            try:
+                data = os.read(self.fd, 0x10000)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+                offset += EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+                yield wd, mask, os.fsdecode(name)
+
+    def close(self):
+        os.close(self.fd)
+
+
+class DirectoryWatcher(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, root, accept, dirs, debounce=1.0):
+        self.root = root
+        self.accept = accept
+        self.debounce = debounce
+        self.inotify = Inotify()
+        self.paths = {}
+        self.wds = {}
+        self.added = set()
+        self.removed = set()
+        self.removed_dirs = set()
+        self.overflow = False
+        self.last_event = None
+        for relpath in dirs:
+            self.watch(relpath)
+
+    def watch(self, relpath):
+        try:
+            wd = self.inotify.add_watch(
+                os.path.join(self.root, relpath), WATCH_MASK)
+        except OSError as exc:
+            self.logger.warning("Could not watch %s: %s", relpath, exc)
+            return
+        self.paths[wd] = relpath
+        self.wds[relpath] = wd
+
+    def unwatch(self, relpath):
+        for path in list(self.wds):
+            if path == relpath or path.startswith(relpath + os.sep):
+                wd = self.wds.pop(path)
+                self.paths.pop(wd, None)
+                self.inotify.rm_watch(wd)
+
+    def close(self):
+        self.inotify.close()
+
+    def file_added(self, relpath):
+        self.removed.discard(relpath)
+        self.added.add(relpath)
+
+    def file_removed(self, relpath):
+        self.added.discard(relpath)
+        self.removed.add(relpath)
+
+    def dir_added(self, relpath):
+        dirs = {}
+        for name in walk(self.root, self.accept, dirs, relpath):
+            self.file_added(name)
+        for path in dirs:
+            self.watch(path)
+
+    def dir_removed(self, relpath):
+        self.unwatch(relpath)
+        self.added = set(
+            x for x in self.added if not x.startswith(relpath + os.sep))
+        self.removed_dirs.add(relpath)
+
+    def poll(self):
+        for wd, mask, name in self.inotify.read():
+            self.last_event = time.monotonic()
+            if mask & IN_Q_OVERFLOW:
+                self.overflow = True
+                continue
+            if mask & IN_IGNORED:
+                relpath = self.paths.pop(wd, None)
+                if relpath is not None:
+                    self.wds.pop(relpath, None)
+                continue
+            if wd not in self.paths or not name:
+                continue
+            if not (self.accept.directory(name) if mask & IN_ISDIR
+                    else self.accept(name)):
+                continue
+            relpath = os.path.join(self.paths[wd], name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    try:
+                        self.dir_added(relpath)
+                    except OSError:
+                        # NOTE: already gone, a later event will tell
+                        pass
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self.dir_removed(relpath)
+            elif mask & (IN_CREATE | IN_CLOSE_WRITE | IN_MOVED_TO):
+                self.file_added(relpath)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.file_removed(relpath)
+
+    def changes(self):
+        self.poll()
+        if self.last_event is None:
+            return None
+        # NOTE: wait for the directories to settle so a bulk copy results in
+        #       a single update
+        if time.monotonic() - self.last_event < self.debounce:
+            return None
+        self.last_event = None
+        added = set(
+            x for x in self.added
+            if os.path.isfile(os.path.join(self.root, x)))
+        removed = self.removed.difference(added)
+        removed_dirs = self.removed_dirs
+        self.added, self.removed, self.removed_dirs = set(), set(), set()
+        return added, removed, removed_dirs
@@ -0,0 +1,59 @@
+import logging
+import subprocess
+import threading
+import time
+
+
+DEFAULT_TIMEOUT = 30
+
+
+class StartupCommand(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, entry, previous=()):
+        if not isinstance(entry, dict):
+            entry = {'command': entry}
+        self.command = entry['command']
+        self.timeout = entry.get('timeout', DEFAULT_TIMEOUT)
+        self.blocking = entry.get('blocking', False)
+        self.after = list(previous) if entry.get('wait') else []
+        self.status = None
+        self.thread = threading.Thread(target=self.run, name="startup")
+        self.thread.daemon = True
+
+    def run(self):
+        for command in self.after:
+            command.thread.join()
+        start = time.monotonic()
+        try:
+            process = subprocess.Popen(
+                self.command, shell=True, stdin=subprocess.DEVNULL)
+        except OSError as exc:
+            self.logger.error("Could not run %r: %s", self.command, exc)
+            return
+        try:
+            self.status = process.wait(self.timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            self.logger.warning("Startup command %r killed after %.1fs",
+                self.command, time.monotonic() - start)
+            return
+        self.logger.log(
+            logging.INFO if self.status == 0 else logging.WARNING,
+            "Startup command %r exited with status %d in %.3fs",
+            self.command, self.status, time.monotonic() - start)
+
+
+def run_startup_commands(entries):
+    commands = []
+    for entry in entries:
+        commands.append(StartupCommand(entry, commands))
+    for command in commands:
+        command.thread.start()
+    # NOTE: only the commands explicitly marked as blocking delay the
+    #       first frame
+    for command in commands:
+        if command.blocking:
+            command.thread.join()
+    return commands
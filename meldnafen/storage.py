@@ -0,0 +1,68 @@
+import json
+import os
+import stat
+import tempfile
+
+
+def cache_dir(settings, name=None):
+    path = os.path.expanduser(settings['cache'])
+    if name:
+        path = os.path.join(path, name)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def load_json(path, default=None):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except Exception:
+        # NOTE: missing or corrupted, the caller is expected to rebuild it
+        return default
+
+
+def read_umask():
+    # NOTE: the umask can only be read by changing it, this is done once at
+    #       import time before the scanner threads start writing files
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+UMASK = read_umask()
+
+
+def file_mode(path):
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        return 0o666 & ~UMASK
+
+
+def atomic_write(path, data, fsync=False):
+    dirname, basename = os.path.split(path)
+    fd, tmp = tempfile.mkstemp(prefix=".%s-" % basename, dir=dirname or ".")
+    try:
+        # NOTE: mkstemp creates the file with mode 0600, keep the mode of the
+        #       file replaced or the default one of a new file
+        os.chmod(tmp, file_mode(path))
+        with os.fdopen(fd, 'wt') as fh:
+            fh.write(data)
+            if fsync:
+                fh.flush()
+                os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    if fsync:
+        # NOTE: make the rename itself durable
+        fd = os.open(dirname or ".", os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def save_json(path, data):
+    atomic_write(path, json.dumps(data, separators=(',', ':')))
@@ -1,27 +1,343 @@
+from array import array
+import ctypes
+import hashlib
+import logging
+import mmap
 import os
-import re
-import sdl2
 import sdl2ui
 from sdl2ui.audio import AudioDevice
+import threading
 import vgmplayer
 
+from meldnafen.music import VGM_REGEX
+
+
+RING_SIZE = 0x10000
+# NOTE: in seconds, the decoder stops on its next write to the closed pipe
+DECODER_TIMEOUT = 1
+# NOTE: 16 bits stereo
+FRAME_SIZE = 4
+SAMPLE_SIZE = 2
+RENDER_CHUNK = 0x4000
+
+
+def byteswap_samples(data):
+    samples = array('h')
+    samples.frombytes(data)
+    samples.byteswap()
+    return memoryview(samples).cast('B')
+
 
 class VgmFile(sdl2ui.resource.BaseResource):
-    regex = re.compile(r".*\.(vgm(\.gz)?|vgz)$")
+    regex = VGM_REGEX
 
     def load(self):
         OUT, IN = os.pipe()
         self.t = vgmplayer.PlayThread(self.filepath, IN, 100)
         self.t.start()
-        self.sample = open(OUT, 'rb')
+        self.sample = open(OUT, 'rb', buffering=0)
+
+    def close(self):
+        self.sample.close()
+        self.t.join(DECODER_TIMEOUT)
+
+
+class PcmCache(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, path, size, length):
+        self.path = path
+        self.size = size
+        # NOTE: the longest track that is rendered, in bytes
+        self.length = length
+
+    def filename(self, filepath, format):
+        st = os.stat(filepath)
+        key = "\0".join(map(str, [
+            os.path.abspath(filepath), st.st_size, st.st_mtime_ns, format]))
+        return os.path.join(self.path,
+            "%s.pcm" % hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def lookup(self, filepath, format):
+        filename = self.filename(filepath, format)
+        try:
+            # NOTE: the mtime of the cached files is used for the LRU
+            os.utime(filename)
+        except OSError:
+            return None
+        return filename
+
+    def recorder(self, filepath, format, length):
+        return PcmRecorder(self, self.filename(filepath, format), length)
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".part"):
+                # NOTE: left by a track that was not rendered entirely, a
+                #       recorder evicts before it opens its own file
+                self.logger.debug("Removing %s from the PCM cache", entry.path)
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+                continue
+            try:
+                entries.append((entry.stat().st_mtime, entry.stat().st_size,
+                    entry.path))
+            except OSError:
+                continue
+        total = sum(x[1] for x in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.size:
+                break
+            self.logger.debug("Evicting %s from the PCM cache", path)
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+
+
+class PcmRecorder(object):
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, cache, filename, length):
+        self.cache = cache
+        self.filename = filename
+        self.length = length
+        self.remaining = length
+        cache.evict()
+        self.fh = open(filename + ".part", 'wb')
+
+    def write(self, data):
+        data = data[:self.remaining]
+        self.fh.write(data)
+        self.remaining -= len(data)
+        if not self.remaining:
+            self.finish()
+
+    def finish(self):
+        if self.fh is None:
+            return
+        self.fh.close()
+        self.fh = None
+        if self.remaining == self.length:
+            os.unlink(self.filename + ".part")
+            return
+        os.replace(self.filename + ".part", self.filename)
+        self.logger.debug("Track rendered in the PCM cache: %s",
+            self.filename)
+        self.cache.evict()
+
+    def abort(self):
+        if self.fh is None:
+            return
+        self.fh.close()
+        self.fh = None
+        try:
+            os.unlink(self.filename + ".part")
+        except OSError:
+            pass
+
+    @property
+    def done(self):
+        return self.fh is None
+
+
+class PcmRenderer(threading.Thread):
+    """
+    Render a VGM track in the PCM cache with a decoder of its own, from its
+    start to the end of its first loop.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, recorder, filepath, swap=False):
+        threading.Thread.__init__(self, name="vgm-render")
+        self.daemon = True
+        self.recorder = recorder
+        self.filepath = filepath
+        self.swap = swap
+        self.stopped = threading.Event()
+
+    def stop(self):
+        self.stopped.set()
+        self.join(DECODER_TIMEOUT)
+
+    def run(self):
+        OUT, IN = os.pipe()
+        # NOTE: the decoder is not paced by an audio device, it renders as
+        #       fast as the pipe is read
+        decoder = vgmplayer.PlayThread(self.filepath, IN, 1)
+        decoder.start()
+        carry = b""
+        try:
+            with open(OUT, 'rb', buffering=0) as stream:
+                while not self.recorder.done:
+                    if self.stopped.is_set():
+                        self.recorder.abort()
+                        break
+                    data = carry + stream.read(RENDER_CHUNK)
+                    if len(data) == len(carry):
+                        # NOTE: the track ended before its announced length
+                        self.recorder.finish()
+                        break
+                    count = len(data) - len(data) % SAMPLE_SIZE
+                    carry = data[count:]
+                    chunk = memoryview(data)[:count]
+                    self.recorder.write(
+                        byteswap_samples(chunk) if self.swap else chunk)
+        except OSError as exc:
+            self.logger.warning("Could not render track: %s", exc)
+            self.recorder.abort()
+        decoder.join(DECODER_TIMEOUT)
+
+
+class RingBuffer(object):
+    def __init__(self, size):
+        self.size = size
+        self.view = memoryview(bytearray(size))
+        self.condition = threading.Condition()
+        self.start = 0
+        self.fill = 0
+        self.eof = False
+        self.closed = False
+        # NOTE: the callback found the buffer empty before the end of the
+        #       track, the producer waiting for free space is expected
+        self.underruns = 0
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+    def feed(self, stream, swap=False):
+        # NOTE: the samples are read and converted in a buffer of the producer
+        #       thread, a read can end in the middle of a sample
+        buffer = bytearray(self.size // 4)
+        view = memoryview(buffer)
+        carry = 0
+        while True:
+            with self.condition:
+                while self.size - self.fill < SAMPLE_SIZE and not self.closed:
+                    self.condition.wait()
+                if self.closed:
+                    return
+                free = min(self.size - self.fill, len(buffer))
+            try:
+                count = stream.readinto(view[carry:free])
+            except (OSError, ValueError):
+                count = 0
+            if not count:
+                with self.condition:
+                    self.eof = True
+                return
+            count += carry
+            carry = count % SAMPLE_SIZE if swap else 0
+            count -= carry
+            if swap:
+                # NOTE: converted here rather than by SDL in the audio
+                #       callback
+                view[:count] = byteswap_samples(view[:count])
+            self.write(view[:count])
+            view[:carry] = view[count:count + carry]
+
+    def write(self, data):
+        with self.condition:
+            end = (self.start + self.fill) % self.size
+        # NOTE: only the consumer moves self.start and it never touches
+        #       the free area, the copy can be done without the lock
+        head = min(len(data), self.size - end)
+        self.view[end:end + head] = data[:head]
+        self.view[:len(data) - head] = data[head:]
+        with self.condition:
+            self.fill += len(data)
+
+    def read_into(self, output, length, align=1):
+        with self.condition:
+            count = min(self.fill, length)
+            count -= count % align
+            head = min(count, self.size - self.start)
+            output[:head] = self.view[self.start:self.start + head]
+            output[head:count] = self.view[:count - head]
+            self.start = (self.start + count) % self.size
+            self.fill -= count
+            self.condition.notify()
+            if count < length and not self.eof:
+                self.underruns += 1
+        return count
 
 
 class VgmPlayer(AudioDevice):
     def load(self):
-        self.stream = self.app.resources[self.props['resource']].sample
+        self.pcm = None
+        self.ring = None
+        self.output = None
+        if self.props.get('pcm'):
+            with open(self.props['pcm'], 'rb') as fh:
+                self.pcm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            self.pcm_view = memoryview(self.pcm)
+            self.position = 0
+            self.loop_start = self.props.get('loop_start', 0)
+            if self.loop_start >= len(self.pcm):
+                self.loop_start = 0
+        else:
+            self.resource = self.app.resources[self.props['resource']]
+            self.stream = self.resource.sample
+            self.ring = RingBuffer(self.props.get('buffer_size', RING_SIZE))
+            self.producer = threading.Thread(
+                target=self.ring.feed,
+                args=(self.stream, self.props.get('swap', False)),
+                name="vgm-ring")
+            self.producer.daemon = True
+            self.producer.start()
 
     def unload(self):
-        self.stream.close()
+        if self.pcm is not None:
+            self.pcm_view.release()
+            self.pcm.close()
+        else:
+            self.stop()
+
+    def stop(self):
+        if self.ring is None or self.ring.closed:
+            return
+        if self.ring.underruns:
+            self.logger.warning("Audio ring buffer: %d underruns",
+                self.ring.underruns)
+        # NOTE: the producer returns after its current read, the decoder
+        #       keeps writing until the pipe is closed
+        self.ring.close()
+        self.producer.join()
+        self.resource.close()
+
+    @property
+    def underruns(self):
+        return self.ring.underruns if self.ring is not None else 0
 
     def callback(self, length):
-        return self.stream.read(length)
+        # NOTE: the output buffer is allocated once and returned as a ctypes
+        #       array so it can be copied to the SDL stream directly
+        if self.output is None or len(self.output) != length:
+            self.output = (ctypes.c_ubyte * length)()
+            self.output_view = memoryview(self.output).cast('B')
+        if self.pcm is not None:
+            self.read_pcm(length)
+            return self.output
+        count = self.ring.read_into(self.output_view, length, FRAME_SIZE)
+        if count < length:
+            self.output_view[count:length] = bytes(length - count)
+        return self.output
+
+    def read_pcm(self, length):
+        # NOTE: the cached track ends with its first loop, it is played
+        #       again from the loop start
+        offset = 0
+        while offset < length:
+            count = min(length - offset, len(self.pcm) - self.position)
+            self.output_view[offset:offset + count] = \
+                self.pcm_view[self.position:self.position + count]
+            offset += count
+            self.position += count
+            if self.position == len(self.pcm):
+                self.position = self.loop_start